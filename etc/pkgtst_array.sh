@@ -10,12 +10,17 @@ DIRNAME="$(pkgtst config slurm_runner:output_dir -p)" || {
     DIRNAME="$SLURM_SUBMIT_DIR"
 }
 
-if [[ $# -eq 0 ]]; then
-    read -r package_id < <(pkgtst enumerate | sed -n "${SLURM_ARRAY_TASK_ID}p")
-else
-    read -r package_id < <(pkgtst enumerate "$@" | sed -n "${SLURM_ARRAY_TASK_ID}p")
+# the job manifest written by SlurmRunner::exec_array, line N+1 (after the
+# header) holds the package of array task N
+manifest="$1"
+
+if [[ -z "$manifest" || ! -r "$manifest" ]]; then
+    printf '%s\n' "[$(date)] ERROR: job manifest not readable (${manifest@Q})"
+    exit 1
 fi
 
+read -r package_id < <(awk -F '\t' -v task_id="${SLURM_ARRAY_TASK_ID}" 'NR > 1 && $1 == task_id { print $2; exit }' "$manifest")
+
 if [[ -z "$package_id" ]]; then
     printf '%s\n' "[$(date)] ERROR: empty package_id (SLURM_ARRAY_TASK_ID: ${SLURM_ARRAY_TASK_ID@Q})"
     exit 1
@@ -24,6 +29,6 @@ fi
 {
 
     printf '%s\n' "SLURM_ARRAY_JOB_ID=${SLURM_ARRAY_JOB_ID@Q}" "SLURM_ARRAY_TASK_ID=${SLURM_ARRAY_TASK_ID@Q}"
-    command time -v pkgtst test "$package_id"
+    command time -v pkgtst test --manifest "$manifest" --task-id "${SLURM_ARRAY_TASK_ID}"
 
 } &> "$DIRNAME"/tests/pkgtst_test_"${package_id//:/_}"_"$(date +'%Y-%m-%dT%H:%M:%S')".log
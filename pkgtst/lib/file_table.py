@@ -0,0 +1,135 @@
+# file_table - compact in-memory storage of file table rows
+
+# A scan of a package with millions of files keeps a row per file in memory.
+# A FileRecord holds the columns of one row in slots (with the digest in
+# binary form and the owner string interned), and a FileTable keeps the
+# records of each package under a single base_path string. Both behave like
+# the dicts they replace: a FileTable maps (base_path, relative_path) to a
+# FileRecord, and a FileRecord maps column names to values.
+
+import sys
+import collections.abc
+
+# columns of the file table that are compared against the baseline
+FILE_COLUMNS = ['mode', 'owner', 'mod_time', 'file_size', 'content_hash']
+
+# stat columns used by fast verify to decide if a file must be re-hashed, these
+# are stored alongside the baseline but never compared
+STAT_COLUMNS = ['inode', 'mtime_ns', 'ctime_ns', 'uid', 'gid']
+
+# describe how content_hash was computed, also stored but never compared
+# (segment_hashes are checked one segment at a time by read_paths())
+HASH_COLUMNS = ['hash_algorithm', 'hash_tier', 'segment_hashes']
+
+ROW_COLUMNS = FILE_COLUMNS + STAT_COLUMNS + HASH_COLUMNS
+
+# hex digests are kept as bytes, anything else (e.g. None) as is
+def pack_digest(value):
+    if isinstance(value, str):
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    return value
+
+def unpack_digest(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+class FileRecord(collections.abc.MutableMapping):
+    __slots__ = ['mode', 'owner', 'mod_time', 'file_size', 'digest', 'inode', 'mtime_ns', 'ctime_ns', 'uid', 'gid',
+                 'hash_algorithm', 'hash_tier', 'segment_hashes']
+
+    def __init__(self, row=None):
+        for column in ROW_COLUMNS:
+            self[column] = None
+        if row is not None:
+            for column in ROW_COLUMNS:
+                if column in row:
+                    self[column] = row[column]
+
+    def __getitem__(self, column):
+        if column == 'content_hash':
+            return unpack_digest(self.digest)
+        if column not in ROW_COLUMNS:
+            raise KeyError(column)
+        return getattr(self, column)
+
+    def __setitem__(self, column, value):
+        if column == 'content_hash':
+            self.digest = pack_digest(value)
+        elif column == 'owner' and value is not None:
+            self.owner = sys.intern(value)
+        elif column in ROW_COLUMNS:
+            setattr(self, column, value)
+        else:
+            raise KeyError(column)
+
+    def __delitem__(self, column):
+        raise TypeError(f"the columns of a FileRecord can't be removed (column: {column})")
+
+    def __iter__(self):
+        return iter(ROW_COLUMNS)
+
+    def __len__(self):
+        return len(ROW_COLUMNS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+class FileTable(collections.abc.MutableMapping):
+
+    def __init__(self):
+        # base_path -> {relative_path: FileRecord}
+        self.packages = dict()
+        self.count = 0
+
+    def __getitem__(self, key):
+        return self.packages[key[0]][key[1]]
+
+    def __setitem__(self, key, record):
+        base_path, relative_path = key
+        rows = self.packages.get(base_path)
+        if rows is None:
+            rows = dict()
+            self.packages[base_path] = rows
+        if relative_path not in rows:
+            self.count += 1
+        if not isinstance(record, FileRecord):
+            record = FileRecord(record)
+        rows[relative_path] = record
+
+    def __delitem__(self, key):
+        del self.packages[key[0]][key[1]]
+        self.count -= 1
+
+    def __contains__(self, key):
+        rows = self.packages.get(key[0])
+        return rows is not None and key[1] in rows
+
+    def __iter__(self):
+        for base_path, rows in self.packages.items():
+            for relative_path in rows:
+                yield (base_path, relative_path)
+
+    def __len__(self):
+        return self.count
+
+    # sets the rows {relative_path: FileRecord} of the package base_path, e.g.
+    # those of a package it is an alias of. The records are shared but the
+    # mapping is copied, so each package can still be changed on its own.
+    def set_package(self, base_path, rows):
+        rows = dict(rows)
+        self.count += len(rows) - len(self.packages.get(base_path, {}))
+        self.packages[base_path] = rows
+
+    # {relative_path: FileRecord} of a single package
+    def package(self, base_path):
+        return self.packages.get(base_path, {})
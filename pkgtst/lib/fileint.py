@@ -2,21 +2,52 @@
 
 import os
 import yaml
+import json
 import sqlite3
 import pathlib
 import hashlib
+import stat
 import sys
 import signal
 import shlex
 import enum
 import pickle
 import multiprocessing
+import multiprocessing.pool
 import fcntl
 import re
+import time
+import datetime
+import glob
+import contextlib
+import threading
+import collections.abc
 
 from pkgtst.lib.logger import Logger
 from pkgtst.lib.logger import LogLevel
 from pkgtst.lib.utils import get_pkgtst_root
+from pkgtst.lib.utils import uid_to_name
+from pkgtst.lib.utils import gid_to_name
+from pkgtst.lib.hasher import Hasher
+from pkgtst.lib.hasher import init_worker
+from pkgtst.lib.hasher import hash_file
+from pkgtst.lib.hasher import algorithm_tag
+from pkgtst.lib.hasher import DEFAULT_ALGORITHM
+from pkgtst.lib.hasher import FULL_TIER
+from pkgtst.lib.hasher import sampled_tier
+from pkgtst.lib.hasher import is_sampled
+from pkgtst.lib.hash_cache import HashCache
+from pkgtst.lib.listing_cache import ListingCache
+from pkgtst.lib.listing_cache import RACY_SECONDS
+from pkgtst.lib.path_rules import PathRuleSet
+from pkgtst.lib.packed_baseline import PackedBaseline
+from pkgtst.lib.packed_baseline import write_packed
+from pkgtst.lib.packed_baseline import MERKLE
+from pkgtst.lib.file_table import FileTable
+from pkgtst.lib.file_table import FileRecord
+from pkgtst.lib.file_table import FILE_COLUMNS
+from pkgtst.lib.file_table import STAT_COLUMNS
+from pkgtst.lib.file_table import HASH_COLUMNS
 
 class MismatchType(enum.Enum):
     MISSING_ROW = 1
@@ -25,6 +56,21 @@ class MismatchType(enum.Enum):
     EXTRA_COLUMN = 4
     WRONG_VALUE = 5
 
+# seconds to wait on a database locked by a concurrent package test
+DB_TIMEOUT = 300
+
+# page cache (KiB) and memory map size (bytes) of each database connection
+DB_CACHE_KIB = 65536
+DB_MMAP_SIZE = 268435456
+
+JOURNAL_MODES = {'delete', 'truncate', 'persist', 'memory', 'wal'}
+
+# the default file name of the baseline in each format
+DB_FILE_NAMES = {'sqlite3': 'fileint.sql', 'pickle': 'fileint.pkl', 'packed': 'fileint.pack'}
+
+# columns added to the file table after its first release, with their types
+ADDED_COLUMNS = {'inode': 'INT', 'mtime_ns': 'INT', 'ctime_ns': 'INT', 'uid': 'INT', 'gid': 'INT',
+                 'hash_algorithm': 'TEXT', 'hash_tier': 'TEXT', 'segment_hashes': 'TEXT'}
 
 def dict_factory(cursor, row):
     d = {}
@@ -102,6 +148,45 @@ class Hierarchy:
 
         return bool(re.fullmatch(self.pattern, rel_path))
 
+# the packages written to a packed baseline by several read_paths() calls
+# (e.g. the package tests of LocalRunner, each with its own FileInt), held
+# until write() rewrites the file once for all of them
+class PackedWrites:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fileint_tbl = dict()
+        self.file_tbl = FileTable()
+        self.dir_tbl = dict()
+
+    def __len__(self):
+        return len(self.fileint_tbl)
+
+    # a package added again replaces what was held for it
+    def add(self, fileint_tbl, file_tbl, dir_tbl=None):
+        with self.lock:
+            for base_path in fileint_tbl:
+                self.fileint_tbl[base_path] = fileint_tbl[base_path]
+                self.file_tbl.set_package(base_path, file_tbl.package(base_path))
+                if dir_tbl is not None and base_path in dir_tbl:
+                    self.dir_tbl[base_path] = dir_tbl[base_path]
+                else:
+                    self.dir_tbl.pop(base_path, None)
+
+    # the base paths of the held packages matching filters
+    def find(self, filters):
+        with self.lock:
+            return [base_path for base_path, fileint_row in self.fileint_tbl.items()
+                    if all([fileint_row.get(myfilter['hierarchy']) == myfilter['value'] for myfilter in (filters or [])])]
+
+    def write(self, fi):
+        with self.lock:
+            if len(self.fileint_tbl) > 0:
+                fi.write_packed_tbls(self.fileint_tbl, self.file_tbl, self.dir_tbl)
+            self.fileint_tbl = dict()
+            self.file_tbl = FileTable()
+            self.dir_tbl = dict()
+
 class FileInt:
 
     def __init__(self, config=None):
@@ -111,6 +196,35 @@ class FileInt:
         self.invalidated = False
         self.max_diff_prints = None
         self.pool_size = 4
+        self.chunk_size = 64
+        self.max_queued_files = 4096
+        self.fast_verify = False
+        self.numeric_owner = False
+        self.pool = None
+        self.pool_type = 'process'
+        self.block_size = 1048576
+        self.mmap_threshold = 67108864
+        self.hash_algorithm = DEFAULT_ALGORITHM
+        self.sample_threshold = None
+        self.sample_stripes = 16
+        self.sample_stripe_size = 1048576
+        self.sample_segments = 8
+        self.hash_cache = None
+        self.listing_cache = None
+        self.journal_mode = None
+        self.write_batch_rows = 100000
+        self.shard_dir = None
+        self.shard = None
+        self.keep_generations = 10
+        # ((dev, inode), rules) -> rows of the package trees scanned so far,
+        # set to a dict to reuse the rows of an alias across read_paths()
+        # calls (see read_paths())
+        self.scanned_trees = None
+        # set to a PackedWrites to defer the packed baseline writes of
+        # read_paths() (see write_tbls())
+        self.packed_writes = None
+        self.path_rules = None
+        self.stats = {'skipped': 0, 'rehashed': 0, 'excluded_files': 0, 'excluded_bytes': 0, 'excluded_dirs': 0}
 
         if config:
             self.config_path = config
@@ -124,10 +238,7 @@ class FileInt:
             self.config = yaml.safe_load(f)
 
         if not self.config['fileint']['dbfile']:
-            if self.config['fileint']['format'] != 'pickle':
-                self.dbfile = os.path.join(get_pkgtst_root(), 'var', 'db', 'fileint.sql')
-            else:
-                self.dbfile = os.path.join(get_pkgtst_root(), 'var', 'db', 'fileint.pkl')
+            self.dbfile = os.path.join(get_pkgtst_root(), 'var', 'db', DB_FILE_NAMES.get(self.config['fileint']['format'], 'fileint.sql'))
         else:
             self.dbfile = self.config['fileint']['dbfile']
 
@@ -138,12 +249,138 @@ class FileInt:
         if self.config['fileint']['pool_size']:
             self.pool_size = self.config['fileint']['pool_size']
 
+        if self.config['fileint'].get('chunk_size'):
+            self.chunk_size = self.config['fileint']['chunk_size']
+
+        # a chunk can only be dispatched once it is full
+        if self.config['fileint'].get('max_queued_files'):
+            self.max_queued_files = self.config['fileint']['max_queued_files']
+        self.max_queued_files = max(self.max_queued_files, 2 * self.chunk_size)
+
+        if self.config['fileint'].get('journal_mode'):
+            self.journal_mode = self.config['fileint']['journal_mode'].lower()
+        if self.journal_mode is not None and self.journal_mode not in JOURNAL_MODES:
+            raise Exception(f"ERROR: unexpected journal_mode {self.journal_mode}!")
+
+        # with shard_dir, each package is kept in a database of its own under
+        # shard_dir (see shard_file()), and dbfile only holds the discovery
+        # index, so that concurrent tests never wait on each other's writes
+        if self.config['fileint'].get('shard_dir'):
+            self.shard_dir = self.config['fileint']['shard_dir']
+            if self.dbformat != 'sqlite3':
+                raise Exception(f"ERROR: shard_dir is only supported for the sqlite3 format (format: {self.dbformat})")
+
+        # baseline generations kept per package for history/rollback/diff,
+        # null or 0 keeps only the current baseline
+        if 'keep_generations' in self.config['fileint']:
+            self.keep_generations = int(self.config['fileint']['keep_generations'] or 0)
+
+        # rows per executemany() batch of a baseline write, null for one batch
+        if 'write_batch_rows' in self.config['fileint']:
+            self.write_batch_rows = self.config['fileint']['write_batch_rows']
+
+        # 'thread' hashes in a thread pool, hashlib releases the GIL
+        if self.config['fileint'].get('pool_type'):
+            self.pool_type = self.config['fileint']['pool_type']
+        if self.pool_type not in {'process', 'thread'}:
+            raise Exception(f"ERROR: unexpected pool_type {self.pool_type}!")
+
+        if self.config['fileint'].get('block_size'):
+            self.block_size = self.config['fileint']['block_size']
+
+        # null disables mmap
+        if 'mmap_threshold' in self.config['fileint']:
+            self.mmap_threshold = self.config['fileint']['mmap_threshold']
+
+        # e.g. blake2b with hash_digest_size: 32, baselines keep the algorithm
+        # they were hashed with until they are accepted again
+        if self.config['fileint'].get('hash_algorithm'):
+            self.hash_algorithm = algorithm_tag(self.config['fileint']['hash_algorithm'], self.config['fileint'].get('hash_digest_size'))
+
+        # files of at least sample_threshold bytes are fingerprinted by sampling
+        # instead of being hashed in full, null disables sampling
+        if self.config['fileint'].get('sample_threshold'):
+            self.sample_threshold = int(self.config['fileint']['sample_threshold'])
+        if self.config['fileint'].get('sample_stripes'):
+            self.sample_stripes = int(self.config['fileint']['sample_stripes'])
+        if self.config['fileint'].get('sample_stripe_size'):
+            self.sample_stripe_size = int(self.config['fileint']['sample_stripe_size'])
+        if self.config['fileint'].get('sample_segments'):
+            self.sample_segments = int(self.config['fileint']['sample_segments'])
+        self.sample_tier = sampled_tier(self.sample_stripes, self.sample_stripe_size, self.sample_segments)
+
+        if self.config['fileint'].get('fast_verify'):
+            self.fast_verify = True
+
+        if self.config['fileint'].get('numeric_owner'):
+            self.numeric_owner = True
+
         self.path_limit = self.config['general']['path_limit']
 
+        # follow_symlinks: symlinks are recorded with the stat of their target
+        # and symlinked directories are walked, otherwise the symlinks
+        # themselves are recorded; no_duplicates: a package directory that is
+        # an alias of another one (e.g. a version symlink) is not a package
+        self.follow_symlinks = bool(self.config['fileint']['follow_symlinks'])
+        self.no_duplicates = bool(self.config['fileint']['no_duplicates'])
+
         self.logger = Logger(config_path=config)
 
+        # include/exclude patterns applied while walking a package, see
+        # path_rules
+        if self.config['fileint'].get('include') or self.config['fileint'].get('exclude') or self.config['fileint'].get('package_rules'):
+            try:
+                self.path_rules = PathRuleSet(self.config['fileint'].get('include'), self.config['fileint'].get('exclude'),
+                                              self.config['fileint'].get('package_rules'))
+            except (re.error, AttributeError, TypeError) as e:
+                self.logger.log(LogLevel.ERROR, f"FileInt's include/exclude/package_rules are not valid -- {e}")
+
+        # content hashes of regular files by inode, shared across packages and
+        # runs
+        if self.config['fileint'].get('hash_cache'):
+            cache_file = self.config['fileint'].get('hash_cache_file')
+            if not cache_file:
+                cache_file = os.path.join(get_pkgtst_root(), 'var', 'db', 'hash_cache.sql')
+            self.hash_cache = HashCache(cache_file, self.config['fileint'].get('hash_cache_max_age'),
+                                        self.config['fileint'].get('hash_cache_max_entries'), config_path=config)
+
+        # directory listings by directory inode/mtime/ctime, shared across
+        # packages and runs
+        if self.config['fileint'].get('listing_cache'):
+            cache_file = self.config['fileint'].get('listing_cache_file')
+            if not cache_file:
+                cache_file = os.path.join(get_pkgtst_root(), 'var', 'db', 'listing_cache.sql')
+            self.listing_cache = ListingCache(cache_file, self.config['fileint'].get('listing_cache_max_age'), config_path=config)
+
+        try:
+            self.hasher = Hasher(self.block_size, self.mmap_threshold, config_path=config, algorithm=self.hash_algorithm)
+        except (ValueError, TypeError) as e:
+            self.logger.log(LogLevel.ERROR, f"FileInt's hash_algorithm is not supported (value: {self.hash_algorithm}) -- {e}")
+
+    # starts a worker pool that is reused by every read_paths() call until
+    # close_pool(), otherwise each call creates (and tears down) its own
+    def open_pool(self):
+        if self.pool is None:
+            if self.pool_type == 'thread':
+                self.pool = multiprocessing.pool.ThreadPool(self.pool_size, initializer=init_worker, initargs=(self.hasher,))
+            else:
+                self.pool = multiprocessing.Pool(self.pool_size, initializer=init_worker, initargs=(self.hasher,))
+        return self.pool
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
     def create_db(self):
-        self.conn = sqlite3.connect(self.dbfile)
+        # the database is built under a temporary name and then moved into
+        # place, so that a concurrent db_connect() never sees it without tables
+        tmp_dbfile = self.dbfile + '.tmp'
+        if os.path.exists(tmp_dbfile):
+            os.remove(tmp_dbfile)
+
+        self.conn = sqlite3.connect(tmp_dbfile)
         self.cursor = self.conn.cursor()
 
         parent_db_schema = """CREATE TABLE IF NOT EXISTS fileint (
@@ -163,16 +400,32 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
                 mod_time INT NOT NULL,
                 file_size INT NOT NULL,
                 content_hash TEXT,
+                inode INT,
+                mtime_ns INT,
+                ctime_ns INT,
+                uid INT,
+                gid INT,
+                hash_algorithm TEXT,
+                hash_tier TEXT,
+                segment_hashes TEXT,
                 base_path TEXT NOT NULL,
                 UNIQUE (base_path, relative_path),
                 FOREIGN KEY (base_path) REFERENCES fileint(base_path)
             )
         """)
 
+        self.create_rotation_tbl()
+        self.create_dir_tbl()
+        self.create_discovery_tbls()
+        self.create_history_tbls()
+        self.create_indexes()
+
         self.conn.commit()
         self.cursor.close()
         self.conn.close()
 
+        os.replace(tmp_dbfile, self.dbfile)
+
         self.logger.log(LogLevel.INFO, f"created database at {self.dbfile}")
 
     def db_connect(self):
@@ -195,39 +448,215 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
             self.logger.log(LogLevel.INFO, f"Database '{self.dbfile}' already exists.")
         
         # Connect to the SQLite database
-        self.conn = sqlite3.connect(self.dbfile)
+        self.conn = sqlite3.connect(self.dbfile, timeout=DB_TIMEOUT)
         
         # Create a cursor object to execute SQL queries
         self.cursor = self.conn.cursor()
 
-    def sha256_checksum(self, filename, block_size=65536):
-        sha256 = hashlib.sha256()
-        if os.path.isfile(filename):
-            try:
-                with open(filename, 'rb') as f:
-                    for block in iter(lambda: f.read(block_size), b''):
-                        sha256.update(block)
-            except PermissionError as e:
-                self.logger.log(LogLevel.WARNING, f"caught exception, could not obtain hash for file {filename} -- {e}")
-            return sha256.hexdigest()
-        else:
-            return ""
+        self.db_pragmas()
+        self.db_migrate()
+
+    # WAL lets tests read the database while a baseline is written, it relies
+    # on shared memory between the processes though, so it is only an opt-in
+    # for databases on a local disk; with journal_mode null the mode stored
+    # in the database (delete unless set otherwise) is left as is
+    def db_pragmas(self):
+        if self.journal_mode:
+            self.cursor.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            if self.journal_mode == 'wal':
+                # durable with WAL, only the last commits may be lost on power loss
+                self.cursor.execute("PRAGMA synchronous = NORMAL")
+        self.cursor.execute(f"PRAGMA cache_size = -{DB_CACHE_KIB}")
+        self.cursor.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+
+    # the number of times each package with sampled files was tested, which
+    # picks the segment verified in full by the next test
+    def create_rotation_tbl(self):
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS segment_rotation (
+                base_path TEXT NOT NULL PRIMARY KEY,
+                runs INT NOT NULL
+            )
+        """)
+
+    # filters look packages up by any of the hierarchy components, the file
+    # rows of a package are found through the (base_path, relative_path)
+    # unique index
+    def create_indexes(self):
+        for component in (self.config['fileint']['hierarchy'] or []):
+            component = self.sanitize_identifier(component)
+            self.cursor.execute(f"CREATE INDEX IF NOT EXISTS fileint_{component} ON fileint ({component})")
+
+    # the Merkle tree of each package, see merkle_digests()
+    def create_dir_tbl(self):
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dir_digest (
+                base_path TEXT NOT NULL,
+                relative_path TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                UNIQUE (base_path, relative_path)
+            )
+        """)
 
+    # the package discovery index, see discover_packages(): the directories
+    # above the package directories with the stat they were listed with, and
+    # the package directories found in them in enumerate order
+    def create_discovery_tbls(self):
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS discovery_dir (
+                path TEXT NOT NULL PRIMARY KEY,
+                dev INT,
+                ino INT,
+                mtime_ns INT,
+                ctime_ns INT,
+                entries TEXT NOT NULL
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS discovery_pkg (
+                seq INT NOT NULL PRIMARY KEY,
+                parent TEXT NOT NULL,
+                fpath TEXT NOT NULL,
+                base_path TEXT NOT NULL,
+                components TEXT NOT NULL,
+                dev INT NOT NULL,
+                ino INT NOT NULL,
+                alias INT NOT NULL,
+                duplicate INT NOT NULL
+            )
+        """)
+
+    # the baseline history of each package: the generations (the current
+    # baseline is the newest) and reverse deltas, the rows of generation g
+    # that differ from generation g + 1 (present = 0 for a file that wasn't
+    # in generation g). Starting from the file table, the deltas of the
+    # generations below the current one give back any generation kept.
+    def create_history_tbls(self):
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS baseline_generation (
+                base_path TEXT NOT NULL,
+                generation INT NOT NULL,
+                created TEXT,
+                hash_of_blob TEXT,
+                PRIMARY KEY (base_path, generation)
+            )
+        """)
+        self.cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS baseline_delta (
+                base_path TEXT NOT NULL,
+                generation INT NOT NULL,
+                relative_path TEXT NOT NULL,
+                present INT NOT NULL,
+                {", ".join([column + " " + ADDED_COLUMNS.get(column, "") for column in FILE_COLUMNS + STAT_COLUMNS + HASH_COLUMNS])},
+                PRIMARY KEY (base_path, generation, relative_path)
+            )
+        """)
+
+    # adds the columns, tables and indexes introduced after a database was created
+    def db_migrate(self):
+        columns = set([row[1] for row in self.cursor.execute("PRAGMA table_info(file)").fetchall()])
+        for column in ADDED_COLUMNS:
+            if column not in columns:
+                self.logger.log(LogLevel.INFO, f"adding column {column} to the file table of {self.dbfile}")
+                self.cursor.execute(f"ALTER TABLE file ADD COLUMN {column} {ADDED_COLUMNS[column]}")
+        self.create_rotation_tbl()
+        self.create_dir_tbl()
+        self.create_discovery_tbls()
+        self.create_history_tbls()
+        self.create_indexes()
+        self.conn.commit()
+
+    # if st is set, it is used instead of stat'ing the file again
+    def sha256_checksum(self, filename, block_size=None, st=None):
+        hasher = self.hasher
+        if block_size is not None and block_size != hasher.block_size:
+            hasher = Hasher(block_size, self.mmap_threshold, config_path=self.config_path, algorithm=self.hash_algorithm)
+        return hasher.checksum(filename, st)
+
+    # the hash_of_blob of baselines written before the directory digests, it
+    # depends on the traversal order of the rows in metadata
     def sha256_checksum_metadata(self, metadata):
-        row_hashes = ""
+        result = hashlib.sha256()
         for row in metadata:
-            row_hashes += hashlib.sha256(", ".join([str(cell) for cell in row]).encode('utf-8')).hexdigest()
-        result = hashlib.sha256(row_hashes.encode('utf-8')).hexdigest()
-        return result
-
-    def get_file_info(self, filepath):
-        p = pathlib.Path(filepath)
-        file_stats = p.stat()
+            result.update(hashlib.sha256(", ".join([str(cell) for cell in row]).encode('utf-8')).hexdigest().encode('utf-8'))
+        return result.hexdigest()
+
+    # returns {directory: hex digest} for the rows {relative_path: row} of a
+    # package, a Merkle tree over its directories. Directories are keyed by
+    # their relative path with a trailing slash, '' is the package root and
+    # its digest becomes the hash_of_blob.
+    #
+    # The digest of a directory covers the sorted names of its entries and,
+    # for each, the FILE_COLUMNS of its row and (for a directory) the digest
+    # of its content, so it doesn't depend on the traversal order and a change
+    # anywhere below a directory changes its digest.
+    def merkle_digests(self, rows):
+        # directory -> relative paths of its entries
+        children = {'': []}
+        # relative path -> digest of the entry
+        entries = dict()
+        for relative_path, row in rows.items():
+            parent = relative_path[:relative_path.rfind('/') + 1]
+            children.setdefault(parent, []).append(relative_path)
+            entries[relative_path] = hashlib.sha256(", ".join([str(row[column]) for column in FILE_COLUMNS]).encode('utf-8')).digest()
+
+        digests = dict()
+        for directory in sorted(children, key=lambda d: d.count('/'), reverse=True):
+            digest = hashlib.sha256()
+            for relative_path in sorted(children[directory]):
+                digest.update(relative_path[len(directory):].encode('utf-8', 'surrogateescape') + b'\0' + entries[relative_path])
+            digests[directory] = digest.hexdigest()
+            if directory != '':
+                # the entry of the directory in its parent covers its content
+                name = directory[:-1]
+                if name not in entries:
+                    children.setdefault(name[:name.rfind('/') + 1], []).append(name)
+                entries[name] = hashlib.sha256(entries.get(name, b'') + digest.digest()).digest()
+        return digests
+
+    # everything is derived from a single stat result, pass in st (e.g. from a
+    # DirEntry) to avoid any further metadata syscalls, and the content hash
+    # (with its algorithm) if it is already known
+    def get_file_info(self, filepath, st=None, sha256=None, algorithm=None):
+        if st is None:
+            st = os.stat(filepath)
+        file_stats = st
         permissions = file_stats.st_mode & 0o777
         mtime = file_stats.st_mtime
         size = file_stats.st_size
-        sha256 = self.sha256_checksum(filepath)
-        return permissions, p.owner(), p.group(), mtime, size, sha256
+        stat_row = {'inode': file_stats.st_ino, 'mtime_ns': file_stats.st_mtime_ns,
+                    'ctime_ns': file_stats.st_ctime_ns, 'uid': file_stats.st_uid,
+                    'gid': file_stats.st_gid}
+        if algorithm is None:
+            algorithm = self.hash_algorithm
+        if sha256 is None:
+            sha256 = self.hasher.checksum(filepath, file_stats, algorithm)
+        if stat.S_ISREG(file_stats.st_mode):
+            stat_row['hash_algorithm'] = algorithm
+        else:
+            stat_row['hash_algorithm'] = None
+        if self.numeric_owner:
+            user, group = str(file_stats.st_uid), str(file_stats.st_gid)
+        else:
+            user, group = uid_to_name(file_stats.st_uid), gid_to_name(file_stats.st_gid)
+        return permissions, user, group, mtime, size, sha256, stat_row
+
+    # with numeric_owner, the owner column holds "uid:gid", names are only
+    # resolved here for display
+    def display_owner(self, owner):
+        match = re.fullmatch(r'(\d+):(\d+)', str(owner))
+        if match is None:
+            return owner
+        return f"{owner} ({uid_to_name(int(match.group(1)))}:{gid_to_name(int(match.group(2)))})"
+
+    # fast verify: a file whose stat tuple matches the baseline row is assumed
+    # to have the same content, so its stored hash is reused
+    def stat_unchanged(self, prev_row, st):
+        if prev_row is None:
+            return False
+        stat_tuple = (st.st_mode & 0o777, st.st_size, st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_uid, st.st_gid)
+        prev_tuple = (prev_row.get('mode'), prev_row.get('file_size')) + tuple(prev_row.get(column) for column in STAT_COLUMNS)
+        return stat_tuple == prev_tuple
 
     def db_save(self):
         
@@ -237,37 +666,265 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
         # Close the connection
         self.conn.close()
 
-    def db_init_tbl(self, fileint_tbl, file_tbl):
+    # writes the packages of fileint_tbl as a delta against their stored rows,
+    # all in one transaction: new and changed file rows are replaced, the rows
+    # of files that vanished from a package are deleted and unchanged rows
+    # aren't written at all, so the cost follows the size of the change
+    #
+    # the changes are written with executemany() (a single prepared
+    # statement) in batches of write_batch_rows rows
+    def db_init_tbl(self, fileint_tbl, file_tbl, dir_tbl=None):
         self.db_connect()
 
+        start = time.monotonic()
 
         h = len(self.config['fileint']['hierarchy'])
         label_str = ", ".join(self.config['fileint']['hierarchy'])
         placeholder_str = ", ".join(["?" for i in self.config['fileint']['hierarchy']])
 
+        if self.config['fileint']['hierarchy'] is not None and len(self.config['fileint']['hierarchy']) > 0:
+            fileint_ins_query = "INSERT OR REPLACE INTO fileint (base_path, " + label_str +  ", hash_of_blob)\nVALUES (?, " + placeholder_str + ", ?)"
+            fileint_rows = [[fpath] + fpath.split("/")[-h:] + [fileint_tbl[fpath]['hash_of_blob']] for fpath in fileint_tbl]
+        else:
+            fileint_ins_query = "INSERT OR REPLACE INTO fileint (base_path, hash_of_blob)\nVALUES (?, ?)"
+            fileint_rows = [[fpath, fileint_tbl[fpath]['hash_of_blob']] for fpath in fileint_tbl]
+
+        columns = FILE_COLUMNS + STAT_COLUMNS + HASH_COLUMNS
+        column_str = ", ".join(columns)
+        placeholder_str = ", ".join(["?" for column in columns])
+        file_ins_query = f"INSERT OR REPLACE INTO file (relative_path, {column_str}, base_path) VALUES (?, {placeholder_str}, ?)"
+
+        # the delta is collected before anything is written, along with the
+        # reverse delta of each package that becomes its history
+        upserts = []
+        deletes = []
+        reverse = dict()
+        for base_path in fileint_tbl:
+            reverse[base_path] = []
+            self.file_delta(base_path, file_tbl.package(base_path), columns, upserts, deletes, reverse[base_path])
+
+        for base_path in fileint_tbl:
+            if self.keep_generations:
+                self.record_generation(base_path, reverse[base_path], fileint_tbl[base_path]['hash_of_blob'], columns)
+            else:
+                # without the history the deltas would no longer apply
+                self.cursor.execute("DELETE FROM baseline_delta WHERE base_path = ?", (base_path,))
+                self.cursor.execute("DELETE FROM baseline_generation WHERE base_path = ?", (base_path,))
+
+        self.cursor.executemany(fileint_ins_query, fileint_rows)
+
+        batch_rows = self.write_batch_rows or max(len(upserts), len(deletes), 1)
+        for i in range(0, len(upserts), batch_rows):
+            self.cursor.executemany(file_ins_query, upserts[i:i + batch_rows])
+        for i in range(0, len(deletes), batch_rows):
+            self.cursor.executemany("DELETE FROM file WHERE base_path = ? AND relative_path = ?", deletes[i:i + batch_rows])
 
-        for row in fileint_tbl:
+        # the directory digests of a package are replaced as a whole
+        for base_path, digests in (dir_tbl or {}).items():
+            self.cursor.execute("DELETE FROM dir_digest WHERE base_path = ?", (base_path,))
+            self.cursor.executemany("INSERT INTO dir_digest (base_path, relative_path, digest) VALUES (?, ?, ?)",
+                                    [(base_path, directory, digest) for directory, digest in digests.items()])
 
-            fpath = row
-            hash_of_blob = fileint_tbl[fpath]['hash_of_blob']
-            
-            if self.config['fileint']['hierarchy'] is not None and len(self.config['fileint']['hierarchy']) > 0:
-                fileint_ins_query = "INSERT OR REPLACE INTO fileint (base_path, " + label_str +  ", hash_of_blob)\nVALUES (?, " + placeholder_str + ", ?)", [fpath] + fpath.split("/")[-h:] + [hash_of_blob]
+        self.db_save()
+
+        elapsed = time.monotonic() - start
+        rate = (len(upserts) + len(deletes)) / elapsed if elapsed > 0 else 0
+        self.logger.log(LogLevel.INFO, f"wrote {len(upserts)} new or changed file rows and deleted {len(deletes)} vanished ones (out of {len(file_tbl)}) in {elapsed:.2f}s ({rate:.0f} rows/s)")
+
+    # merge joins the rows {relative_path: row} of a package with its stored
+    # rows, appending the rows to write to upserts and the (base_path,
+    # relative_path) of the rows to remove to deletes. If reverse is set, the
+    # stored state of each path that changes is appended to it as
+    # [relative_path, present] + values.
+    def file_delta(self, base_path, rows, columns, upserts, deletes, reverse=None):
+        cursor = self.conn.execute(f"SELECT relative_path, {', '.join(columns)} FROM file WHERE base_path = ? ORDER BY relative_path", (base_path,))
+        current = iter(sorted(rows))
+        cur = next(current, None)
+        prev = next(cursor, None)
+        while cur is not None or prev is not None:
+            if prev is None or (cur is not None and cur < prev[0]):
+                upserts.append([cur] + [rows[cur].get(column) for column in columns] + [base_path])
+                if reverse is not None:
+                    reverse.append([cur, 0] + [None for column in columns])
+                cur = next(current, None)
+            elif cur is None or prev[0] < cur:
+                deletes.append((base_path, prev[0]))
+                if reverse is not None:
+                    reverse.append([prev[0], 1] + list(prev[1:]))
+                prev = next(cursor, None)
             else:
-                fileint_ins_query = "INSERT OR REPLACE INTO fileint (base_path, hash_of_blob)\nVALUES (?, ?)", [fpath, hash_of_blob]
+                values = [rows[cur].get(column) for column in columns]
+                if tuple(values) != tuple(prev[1:]):
+                    upserts.append([cur] + values + [base_path])
+                    if reverse is not None:
+                        reverse.append([cur, 1] + list(prev[1:]))
+                cur = next(current, None)
+                prev = next(cursor, None)
+
+    # adds a generation for the baseline of base_path that is about to be
+    # written, reverse holds the stored rows it replaces (see file_delta())
+    # and they become the delta of the generation below. A baseline written
+    # before the history becomes generation 1. Generations beyond
+    # keep_generations are dropped, being reverse deltas, the newer ones
+    # don't depend on them.
+    def record_generation(self, base_path, reverse, hash_of_blob, columns):
+        row = self.cursor.execute("SELECT hash_of_blob FROM fileint WHERE base_path = ?", (base_path,)).fetchone()
+        current = self.cursor.execute("SELECT MAX(generation) FROM baseline_generation WHERE base_path = ?", (base_path,)).fetchone()[0]
+        created = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        if row is None:
+            # the first baseline of the package
+            self.cursor.execute("DELETE FROM baseline_delta WHERE base_path = ?", (base_path,))
+            self.cursor.execute("DELETE FROM baseline_generation WHERE base_path = ?", (base_path,))
+            self.cursor.execute("INSERT INTO baseline_generation (base_path, generation, created, hash_of_blob) VALUES (?, 1, ?, ?)", (base_path, created, hash_of_blob))
+            return
+        if len(reverse) == 0 and row[0] == hash_of_blob and current is not None:
+            return
+        if current is None:
+            current = 1
+            self.cursor.execute("INSERT INTO baseline_generation (base_path, generation, created, hash_of_blob) VALUES (?, 1, NULL, ?)", (base_path, row[0]))
 
-            self.cursor.execute(fileint_ins_query[0], fileint_ins_query[1])
+        self.cursor.executemany(f"INSERT OR REPLACE INTO baseline_delta (base_path, generation, relative_path, present, {', '.join(columns)}) VALUES (?, ?, ?, ?, {', '.join(['?' for column in columns])})",
+                                [[base_path, current] + values for values in reverse])
+        self.cursor.execute("INSERT OR REPLACE INTO baseline_generation (base_path, generation, created, hash_of_blob) VALUES (?, ?, ?, ?)", (base_path, current + 1, created, hash_of_blob))
 
-        for row in file_tbl:
-            
-            file_ins_query = "INSERT OR REPLACE INTO file (relative_path, mode, owner, mod_time, file_size, content_hash, base_path) VALUES (?, ?, ?, ?, ?, ?, ?) ", [row[1]] + [file_tbl[row][column] for column in file_tbl[row]] + [row[0]]
-            self.cursor.execute(file_ins_query[0], file_ins_query[1])
+        oldest = current + 1 - self.keep_generations
+        self.cursor.execute("DELETE FROM baseline_delta WHERE base_path = ? AND generation <= ?", (base_path, oldest))
+        self.cursor.execute("DELETE FROM baseline_generation WHERE base_path = ? AND generation <= ?", (base_path, oldest))
 
-        self.db_save()
+    # returns {base_path: [(generation, created, hash_of_blob, changed files)]}
+    # of the packages matching filters, oldest generation first, the changed
+    # files are those the next generation changed
+    def history(self, filters):
+
+        if self.dbformat != 'sqlite3':
+            raise Exception(f"ERROR: only sqlite3 is supported for the baseline history (dbformat: {self.dbformat})")
+
+        if self.shard_dir is not None and self.shard is None:
+            results = dict()
+            for shard_file in self.shard_files(filters):
+                with self.use_shard(shard_file):
+                    results.update(self.history(filters))
+            return results
+
+        query, params = self.filter_query("SELECT base_path FROM fileint", filters)
+        self.db_connect()
+        try:
+            results = dict()
+            for row in self.cursor.execute(query, params).fetchall():
+                results[row[0]] = self.cursor.execute("""SELECT g.generation, g.created, g.hash_of_blob, COUNT(d.relative_path)
+                    FROM baseline_generation g LEFT JOIN baseline_delta d ON d.base_path = g.base_path AND d.generation = g.generation
+                    WHERE g.base_path = ? GROUP BY g.generation ORDER BY g.generation""", (row[0],)).fetchall()
+        finally:
+            self.conn.close()
+        return results
+
+    # makes the given generation (by default the one before the current) the
+    # baseline of the packages matching filters, the rollback is recorded as a
+    # new generation so it can be rolled back as well
+    def rollback(self, filters, generation=None):
+
+        if self.dbformat != 'sqlite3':
+            raise Exception(f"ERROR: only sqlite3 is supported for the baseline history (dbformat: {self.dbformat})")
+
+        if self.shard_dir is not None and self.shard is None:
+            for shard_file in self.shard_files(filters):
+                with self.use_shard(shard_file):
+                    self.rollback(filters, generation)
+            return
+
+        for base_path, generations in self.history(filters).items():
+            target = generation
+            if target is None:
+                if len(generations) < 2:
+                    self.logger.log(LogLevel.ERROR, f"{base_path} has no generation before the current one to roll back to")
+                target = generations[-2][0]
+            rows, hash_of_blob = self.generation_rows(base_path, target)
+
+            self.db_connect()
+            try:
+                has_digests = self.cursor.execute("SELECT 1 FROM dir_digest WHERE base_path = ? LIMIT 1", (base_path,)).fetchone() is not None
+            finally:
+                self.conn.close()
+
+            file_tbl = FileTable()
+            for relative_path, row in rows.items():
+                file_tbl[(base_path, relative_path)] = row
+            dir_tbl = None
+            if has_digests:
+                dir_tbl = {base_path: self.merkle_digests(rows)}
+            self.db_init_tbl({base_path: {'hash_of_blob': hash_of_blob}}, file_tbl, dir_tbl)
+            self.logger.log(LogLevel.INFO, f"rolled the baseline of {base_path} back to generation {target}")
+
+    # returns {base_path: diffs} between generations a and b (by default the
+    # current one) of the packages matching filters, with the diffs as from
+    # tbl_compare(), only the files changed in between are read
+    def diff_generations(self, filters, a, b=None):
+
+        if self.dbformat != 'sqlite3':
+            raise Exception(f"ERROR: only sqlite3 is supported for the baseline history (dbformat: {self.dbformat})")
+
+        if self.shard_dir is not None and self.shard is None:
+            results = dict()
+            for shard_file in self.shard_files(filters):
+                with self.use_shard(shard_file):
+                    results.update(self.diff_generations(filters, a, b))
+            return results
+
+        results = dict()
+        for base_path, generations in self.history(filters).items():
+            gen_b = b
+            if gen_b is None:
+                gen_b = generations[-1][0] if generations else None
+            self.db_connect()
+            try:
+                paths = set([row[0] for row in self.cursor.execute("SELECT relative_path FROM baseline_delta WHERE base_path = ? AND generation >= ? AND generation < ?",
+                                                                   (base_path, min(a, gen_b or a), max(a, gen_b or a))).fetchall()])
+            finally:
+                self.conn.close()
+            rows_a, blob_a = self.generation_rows(base_path, a, paths)
+            rows_b, blob_b = self.generation_rows(base_path, gen_b, paths)
+            diffs = self.tbl_compare({base_path: {'hash_of_blob': blob_a}}, {base_path: {'hash_of_blob': blob_b}})
+            diffs.extend(self.tbl_compare(dict([((base_path, relative_path), row) for relative_path, row in rows_a.items()]),
+                                          dict([((base_path, relative_path), row) for relative_path, row in rows_b.items()])))
+            results[base_path] = diffs
+        return results
+
+    # returns the rows {relative_path: FileRecord} of a package in the given
+    # generation and its hash_of_blob, only for the relative paths in paths if
+    # set, by undoing the newer generations on the current rows one by one
+    def generation_rows(self, base_path, generation, paths=None):
+        columns = FILE_COLUMNS + STAT_COLUMNS + HASH_COLUMNS
+        self.db_connect()
+        try:
+            kept = dict(self.cursor.execute("SELECT generation, hash_of_blob FROM baseline_generation WHERE base_path = ?", (base_path,)).fetchall())
+            if generation not in kept:
+                self.logger.log(LogLevel.ERROR, f"generation {generation} of {base_path} is not kept (generations: {', '.join([str(g) for g in sorted(kept)]) or 'none'})")
+
+            query = f"SELECT relative_path, {', '.join(columns)} FROM file WHERE base_path = ?"
+            if paths is None:
+                selected = self.cursor.execute(query, (base_path,)).fetchall()
+            else:
+                selected = []
+                for relative_path in paths:
+                    selected.extend(self.cursor.execute(query + " AND relative_path = ?", (base_path, relative_path)).fetchall())
+            rows = dict([(row[0], FileRecord(dict(zip(columns, row[1:])))) for row in selected])
+
+            for newer in range(max(kept), generation, -1):
+                for row in self.cursor.execute(f"SELECT relative_path, present, {', '.join(columns)} FROM baseline_delta WHERE base_path = ? AND generation = ?", (base_path, newer - 1)):
+                    if paths is not None and row[0] not in paths:
+                        continue
+                    if row[1]:
+                        rows[row[0]] = FileRecord(dict(zip(columns, row[2:])))
+                    else:
+                        rows.pop(row[0], None)
+        finally:
+            self.conn.close()
+        return rows, kept[generation]
 
-    def tbl_add_row(self, relative_path, base_path):
+    def tbl_add_row(self, relative_path, base_path, st=None, sha256=None, algorithm=None):
 
-        perms, user, group, mtime, size, sha256 = self.get_file_info(relative_path)
+        perms, user, group, mtime, size, sha256, stat_row = self.get_file_info(relative_path, st, sha256, algorithm)
 
         relative_path = str(relative_path)
         perms = int(perms)
@@ -282,7 +939,8 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
         if relative_path[0] == '/':
             relative_path = relative_path[1:]
 
-        result = {'mode': perms, 'owner': owner, 'mod_time': mtime, 'file_size': size, 'content_hash': sha256}
+        result = FileRecord({'mode': perms, 'owner': owner, 'mod_time': mtime, 'file_size': size, 'content_hash': sha256})
+        result.update(stat_row)
 
         return result
 
@@ -298,10 +956,12 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
         return self.cursor.execute("SELECT * FROM fileint").fetchall(), self.cursor.execute("SELECT * FROM file").fetchall()
 
     # this function expects A and B to both be lists of dictionaries
-    # it will report a list of elements that are different
-    def tbl_compare(self, A, B):
+    # it will report a list of elements that are different, columns listed in
+    # ignore_columns are skipped
+    def tbl_compare(self, A, B, ignore_columns=STAT_COLUMNS + HASH_COLUMNS):
 
         diffs = []
+        ignore_columns = set(ignore_columns or [])
 
         extra_rows = set(B.keys()) - set(A.keys())
         for extra_row in extra_rows:
@@ -311,19 +971,69 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
             if i not in B:
                 diffs.append({'A': A[i], 'B': None, 'mismatch_type': MismatchType.MISSING_ROW, 'row': i, 'column': None})
             else:
-                extra_keys = set(B[i].keys()) - set(A[i].keys())
-                for extra_key in extra_keys:
-                    diffs.append({'A': A[i], 'B': B[i], 'mismatch_type': MismatchType.EXTRA_COLUMN, 'row': i, 'column': extra_key})
-                for j in A[i]:
-                    if j not in B[i]:
-                        diffs.append({'A': A[i], 'B': B[i], 'mismatch_type': MismatchType.MISSING_COLUMN, 'row': i, 'column': j})
-                    else:
-                        if A[i][j] != B[i][j]:
-                            diffs.append({'A': A[i], 'B': B[i], 'mismatch_type': MismatchType.WRONG_VALUE, 'row': i, 'column': j})
+                diffs.extend(self.row_compare(i, A[i], B[i], ignore_columns))
                             
         return diffs
 
-    def read_saved_tbls(self, filters=None):
+    # the column diffs between two versions a and b of the row i
+    def row_compare(self, i, a, b, ignore_columns):
+        extra_keys = set(b.keys()) - set(a.keys()) - ignore_columns
+        for extra_key in extra_keys:
+            yield {'A': a, 'B': b, 'mismatch_type': MismatchType.EXTRA_COLUMN, 'row': i, 'column': extra_key}
+        for j in a:
+            if j in ignore_columns:
+                continue
+            if j not in b:
+                yield {'A': a, 'B': b, 'mismatch_type': MismatchType.MISSING_COLUMN, 'row': i, 'column': j}
+            elif a[j] != b[j]:
+                yield {'A': a, 'B': b, 'mismatch_type': MismatchType.WRONG_VALUE, 'row': i, 'column': j}
+
+    # compares the current rows of a package, a list of (relative_path, row)
+    # sorted by relative_path, with a cursor over its baseline rows in the same
+    # order, yielding the same diffs as tbl_compare() without loading the
+    # baseline into memory (sqlite3 only)
+    #
+    # if dirs is set, only the baseline rows of entries directly in those
+    # directories (given as in merkle_digests()) are read, rows should then
+    # be limited to the same entries
+    def stream_compare(self, base_path, rows, ignore_columns=STAT_COLUMNS + HASH_COLUMNS, dirs=None):
+        ignore_columns = set(ignore_columns or [])
+        self.db_connect()
+        self.conn.row_factory = sqlite3.Row
+        try:
+            if dirs is None:
+                cursor = self.conn.execute("SELECT * FROM file WHERE base_path = ? ORDER BY relative_path", (base_path,))
+            else:
+                self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS compare_dirs (relative_path TEXT PRIMARY KEY)")
+                self.conn.execute("DELETE FROM compare_dirs")
+                self.conn.executemany("INSERT INTO compare_dirs (relative_path) VALUES (?)", [(directory,) for directory in dirs])
+                # rtrim() strips the last path component, leaving the parent
+                # directory with its trailing slash
+                cursor = self.conn.execute("SELECT * FROM file WHERE base_path = ? AND rtrim(relative_path, replace(relative_path, '/', '')) IN compare_dirs ORDER BY relative_path", (base_path,))
+            current = iter(rows)
+            cur = next(current, None)
+            prev = next(cursor, None)
+            while cur is not None or prev is not None:
+                if prev is not None:
+                    prev_path = prev['relative_path']
+                if prev is None or (cur is not None and cur[0] < prev_path):
+                    yield {'A': None, 'B': cur[1], 'mismatch_type': MismatchType.EXTRA_ROW, 'row': (base_path, cur[0]), 'column': None}
+                    cur = next(current, None)
+                    continue
+                prev_row = dict(prev)
+                del prev_row['base_path']
+                del prev_row['relative_path']
+                if cur is None or prev_path < cur[0]:
+                    yield {'A': prev_row, 'B': None, 'mismatch_type': MismatchType.MISSING_ROW, 'row': (base_path, prev_path), 'column': None}
+                else:
+                    yield from self.row_compare((base_path, prev_path), prev_row, cur[1], ignore_columns)
+                    cur = next(current, None)
+                prev = next(cursor, None)
+        finally:
+            self.conn.close()
+
+    # with files=False, only the fileint rows are read from an sqlite3 database
+    def read_saved_tbls(self, filters=None, files=True):
 
         prev_fileint_tbl, prev_file_tbl = None, None
         
@@ -331,28 +1041,30 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
             if self.dbformat == 'pickle':
                 with open(self.dbfile, 'rb') as pkl_file:
                     prev_fileint_tbl, prev_file_tbl = pickle.load(pkl_file)
+            elif self.dbformat == 'packed':
+                prev_fileint_tbl = {}
+                prev_file_tbl = FileTable()
+
+                # only the records of the matched packages are unpacked
+                with PackedBaseline(self.dbfile) as packed:
+                    for i in packed.find(dict([(myfilter['hierarchy'], myfilter['value']) for myfilter in (filters or [])])):
+                        base_path, fileint_row, flags = packed.package(i)
+                        prev_fileint_tbl[base_path] = fileint_row
+                        if files:
+                            for relative_path, row in packed.rows(i).items():
+                                prev_file_tbl[(base_path, relative_path)] = row
             elif self.dbformat == 'sqlite3':
                 self.db_connect()
 
                 prev_fileint_tbl = {}
-                prev_file_tbl = {}
+                prev_file_tbl = FileTable()
 
                 self.conn.row_factory = sqlite3.Row
                 self.cursor.close()
                 self.cursor = self.conn.cursor()
-                if filters is None:
-                    self.cursor.execute("SELECT * FROM fileint")
-                else:
-                    fi_query = "SELECT * FROM fileint WHERE "
-                    filters_i = 1
-                    for myfilter in filters:
-                        fi_query += f"{myfilter['hierarchy']} = \"{myfilter['value']}\""
-                        if len(filters) == filters_i:
-                            break
-                        fi_query += " AND "
-                        filters_i += 1
-                    self.logger.log(LogLevel.TRACE, f"fi_query: {fi_query}")
-                    self.cursor.execute(fi_query)
+                fi_query, params = self.filter_query("SELECT * FROM fileint", filters)
+                self.logger.log(LogLevel.TRACE, f"fi_query: {fi_query} {params}")
+                self.cursor.execute(fi_query, params)
 
                 base_path_set = set()
                 # row in this case is a sqlite3.Row object
@@ -363,27 +1075,20 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
                     del row['base_path']
                     prev_fileint_tbl[key] = row
 
-                if filters is None:
-                    self.cursor.execute("SELECT * FROM file")
+                # one indexed lookup per package, so only the rows of the
+                # matched packages are read
+                if not files:
+                    queries = []
+                elif filters is None:
+                    queries = [("SELECT * FROM file", [])]
                 else:
-                    f_query = "SELECT * FROM file WHERE base_path IN ("
-                    for base_path_value in base_path_set:
-                        base_i = 1
-                        f_query += f"\"{base_path_value}\""
-                        if len(base_path_set) == base_i:
-                            f_query += ")"
-                            break
-                        f_query += ", "
-                    self.logger.log(LogLevel.TRACE, f"f_query = {f_query}")
-                    self.logger.log(LogLevel.TRACE, f"filters = {filters}")
-                    self.cursor.execute(f_query)
-                # row in this case is a sqlite3.Row object
-                for row in self.cursor.fetchall():
-                    row = dict(row)
-                    key = (row['base_path'], row['relative_path'])
-                    del row['base_path']
-                    del row['relative_path']
-                    prev_file_tbl[key] = row
+                    queries = [("SELECT * FROM file WHERE base_path = ?", [base_path]) for base_path in base_path_set]
+                for f_query, params in queries:
+                    self.logger.log(LogLevel.TRACE, f"f_query = {f_query} {params}")
+                    self.cursor.execute(f_query, params)
+                    # row in this case is a sqlite3.Row object
+                    for row in self.cursor:
+                        prev_file_tbl[(row['base_path'], row['relative_path'])] = FileRecord(dict(row))
 
                 self.conn.close()
         else:
@@ -391,16 +1096,121 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
         
         return prev_fileint_tbl, prev_file_tbl
 
-    def write_tbls(self, fileint_tbl, file_tbl):
-        if self.dbformat == 'pickle':
+    # with packed_writes set, the packages are only written by its write(),
+    # since each write rewrites the whole packed baseline
+    def write_tbls(self, fileint_tbl, file_tbl, dir_tbl=None):
+        if self.dbformat == 'packed' and self.packed_writes is not None:
+            self.logger.log(LogLevel.INFO, f"holding {len(fileint_tbl)} packages until the packed baseline {self.dbfile} is written")
+            self.packed_writes.add(fileint_tbl, file_tbl, dir_tbl)
+        elif self.dbformat == 'pickle':
             self.logger.log(LogLevel.INFO, f"{self.dbfile} does not exist, writing baseline")
             with open(self.dbfile, 'wb') as pkl_file:
-                pickle.dump([fileint_tbl, file_tbl], pkl_file)
+                # plain dicts, as in the pickles written by older versions
+                pickle.dump([fileint_tbl, {key: dict(file_tbl[key]) for key in file_tbl}], pkl_file)
+        elif self.dbformat == 'packed':
+            self.write_packed_tbls(fileint_tbl, file_tbl, dir_tbl)
         elif self.dbformat == 'sqlite3':
-            self.db_init_tbl(fileint_tbl, file_tbl)
+            self.db_init_tbl(fileint_tbl, file_tbl, dir_tbl)
         else:
             raise Exception(f"ERROR: unexpected database format {self.dbformat}!")
 
+    # writes the packages of fileint_tbl to the packed baseline, the other
+    # packages are copied over from the current file (except for those in
+    # removed), the whole file is rewritten under the lock of dbfile
+    def write_packed_tbls(self, fileint_tbl, file_tbl, dir_tbl=None, removed=()):
+        start = time.monotonic()
+        with open(self.dbfile + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            old = None
+            try:
+                packages = [(base_path, fileint_tbl[base_path], MERKLE if base_path in (dir_tbl or {}) else 0) for base_path in fileint_tbl]
+                kept = dict()
+                if os.path.exists(self.dbfile):
+                    old = PackedBaseline(self.dbfile)
+                    for i in range(len(old)):
+                        base_path, fileint_row, flags = old.package(i)
+                        if base_path not in fileint_tbl and base_path not in removed:
+                            packages.append((base_path, fileint_row, flags))
+                            kept[base_path] = i
+
+                def rows(base_path):
+                    if base_path in kept:
+                        return old.rows(kept[base_path])
+                    return file_tbl.package(base_path)
+
+                write_packed(self.dbfile, self.config['fileint']['hierarchy'], packages, rows)
+            finally:
+                if old is not None:
+                    old.close()
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        elapsed = time.monotonic() - start
+        self.logger.log(LogLevel.INFO, f"wrote {len(fileint_tbl)} packages to the packed baseline {self.dbfile} ({len(packages)} in total) in {elapsed:.2f}s")
+
+    # combines the sqlite3 baselines sqlite_files (e.g. the shards under
+    # shard_dir) into the packed baseline packed_file, the sqlite3 databases
+    # are only read and the rows are read one package at a time
+    def sqlite_to_packed(self, sqlite_files, packed_file):
+        packages = []
+        # base_path -> the database holding it
+        sources = dict()
+        for sqlite_file in sqlite_files:
+            if not os.path.exists(sqlite_file):
+                raise Exception(f"ERROR: sqlite3 baseline {sqlite_file} does not exist")
+            conn = sqlite3.connect(sqlite_file, timeout=DB_TIMEOUT)
+            conn.row_factory = sqlite3.Row
+            try:
+                merkle = set()
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dir_digest'").fetchone() is not None:
+                    merkle = set([row[0] for row in conn.execute("SELECT DISTINCT base_path FROM dir_digest")])
+                for row in conn.execute("SELECT * FROM fileint"):
+                    row = dict(row)
+                    base_path = row.pop('base_path')
+                    if base_path in sources:
+                        self.logger.log(LogLevel.WARNING, f"{base_path} is in both {sources[base_path]} and {sqlite_file}, keeping the first")
+                        continue
+                    sources[base_path] = sqlite_file
+                    packages.append((base_path, row, MERKLE if base_path in merkle else 0))
+            finally:
+                conn.close()
+
+        def rows(base_path):
+            conn = sqlite3.connect(sources[base_path], timeout=DB_TIMEOUT)
+            conn.row_factory = sqlite3.Row
+            try:
+                return dict([(row['relative_path'], FileRecord(dict(row))) for row in conn.execute("SELECT * FROM file WHERE base_path = ?", (base_path,))])
+            finally:
+                conn.close()
+
+        write_packed(packed_file, self.config['fileint']['hierarchy'], packages, rows)
+        self.logger.log(LogLevel.INFO, f"converted {len(packages)} packages from {', '.join(sqlite_files)} to the packed baseline {packed_file}")
+
+    # writes the packages of the packed baseline packed_file to the sqlite3
+    # baseline sqlite_file (which a sharded setup migrates into its shards on
+    # first use), one package per transaction
+    def packed_to_sqlite(self, packed_file, sqlite_file):
+        if not os.path.exists(packed_file):
+            raise Exception(f"ERROR: packed baseline {packed_file} does not exist")
+        dbfile, dbformat = self.dbfile, self.dbformat
+        self.dbfile, self.dbformat = sqlite_file, 'sqlite3'
+        try:
+            with PackedBaseline(packed_file) as packed:
+                for i in range(len(packed)):
+                    base_path, fileint_row, flags = packed.package(i)
+                    rows = packed.rows(i)
+                    file_tbl = FileTable()
+                    for relative_path, row in rows.items():
+                        file_tbl[(base_path, relative_path)] = row
+                    # the directory digests are derived from the rows
+                    dir_tbl = None
+                    if flags & MERKLE:
+                        dir_tbl = {base_path: self.merkle_digests(rows)}
+                    self.db_init_tbl({base_path: fileint_row}, file_tbl, dir_tbl)
+                count = len(packed)
+        finally:
+            self.dbfile, self.dbformat = dbfile, dbformat
+        self.logger.log(LogLevel.INFO, f"converted {count} packages from the packed baseline {packed_file} to {sqlite_file}")
+
     def print_diffs(self, diffs, header):
         self.logger.log(LogLevel.VERBOSE, f"{header} - START")
         if len(diffs):
@@ -414,27 +1224,324 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
                 self.logger.log(LogLevel.VERBOSE, f"diff #{i} {'mismatch_type'}: {diffs[i]['mismatch_type']}")
                 for key in diffs[i]:
                     if key != 'mismatch_type':
-                        self.logger.log(LogLevel.VERBOSE, f"diff #{i} - {key}: {diffs[i][key]}")
+                        value = diffs[i][key]
+                        if key in ('A', 'B') and isinstance(value, collections.abc.Mapping) and 'owner' in value:
+                            value = dict(value)
+                            value['owner'] = self.display_owner(value['owner'])
+                        self.logger.log(LogLevel.VERBOSE, f"diff #{i} - {key}: {value}")
         self.logger.log(LogLevel.VERBOSE, f"{header} - END")
 
-    def process_file(self, filepath):
+    def process_file(self, filepath, st, sha256, algorithm=None, tier=FULL_TIER, segment_hashes=None):
         base_path = self.base_path
         relative_path = str(filepath)[len(base_path):]
         if relative_path[0] == '/':
             relative_path = relative_path[1:]
-        new_row = self.tbl_add_row(filepath, base_path)
+        new_row = self.tbl_add_row(filepath, base_path, st, sha256, algorithm)
+        if stat.S_ISREG(st.st_mode):
+            new_row['hash_tier'] = tier
+            new_row['segment_hashes'] = segment_hashes
+        else:
+            new_row['hash_tier'] = None
+            new_row['segment_hashes'] = None
         return (base_path, relative_path), new_row
 
+    # the hash tier used for a new row
+    def get_tier(self, size):
+        if self.sample_threshold is not None and size >= self.sample_threshold:
+            return self.sample_tier
+        return FULL_TIER
+
+    # merges the segment hashes computed for a sampled file with the ones of
+    # its baseline row, keys whose verified segment differs are added to
+    # self.segment_mismatches. When a baseline is accepted (segment is None)
+    # all of the segments were hashed and they replace the stored ones.
+    def merge_segments(self, key, prev_row, segment_hashes, segment):
+        if segment_hashes is None:
+            return None
+        if segment is None:
+            return ",".join([segment_hash or '' for segment_hash in segment_hashes])
+        prev_segments = None
+        if prev_row is not None and prev_row.get('segment_hashes'):
+            prev_segments = prev_row['segment_hashes'].split(',')
+        if prev_segments is None or len(prev_segments) != len(segment_hashes):
+            return ",".join([segment_hash or '' for segment_hash in segment_hashes])
+        for i, segment_hash in enumerate(segment_hashes):
+            if segment_hash is not None and segment_hash != prev_segments[i]:
+                self.segment_mismatches.append(key)
+        return prev_row['segment_hashes']
+
+    # returns {base_path: runs} for the given packages and counts this run,
+    # the pickle format can't be updated in place, so the day number is used
+    # as the rotation counter there instead
+    def advance_rotation(self, base_paths):
+        if len(base_paths) == 0:
+            return {}
+        if self.dbformat != 'sqlite3':
+            day = int(time.time() // 86400)
+            return {base_path: day for base_path in base_paths}
+        runs = {}
+        self.db_connect()
+        for base_path in base_paths:
+            row = self.cursor.execute("SELECT runs FROM segment_rotation WHERE base_path = ?", (base_path,)).fetchone()
+            runs[base_path] = row[0] if row else 0
+            self.cursor.execute("INSERT OR REPLACE INTO segment_rotation (base_path, runs) VALUES (?, ?)", (base_path, runs[base_path] + 1))
+        self.db_save()
+        return runs
+
+    # walks a package depth-first with os.scandir, yielding the same paths in
+    # the same order as pathlib's rglob('*') but without materializing the
+    # whole tree first
+    #
+    # each path is yielded with its stat result, which is the only metadata
+    # syscall made for it. With follow_symlinks, symlinks are stat'ed through
+    # and symlinked directories outside of the package are walked as well
+    # (the ones inside of it are walked through their real path). Directories
+    # are only ever walked once by (dev, inode), which also ends loops.
+    # Without follow_symlinks, symlinks are lstat'ed and never followed.
+    #
+    # with a listing_cache, the stored listing of a directory is used instead
+    # of reading the directory while its inode, mtime and ctime are unchanged
+    #
+    # Entries excluded by rules (a PathRules) are counted in self.stats but not
+    # yielded, excluded directories are not walked.
+    def walk_package(self, root, listing_cache=None, rules=None):
+
+        if self.path_limit is not None:
+            pkg_path = str(pathlib.Path(self.path_limit))
+        else:
+            pkg_path = '\0'
+
+        real_root = os.path.realpath(root)
+        try:
+            root_st = os.stat(root)
+        except OSError as e:
+            self.logger.log(LogLevel.WARNING, f"could not stat {root} -- {e}")
+            return
+        visited = set([(root_st.st_dev, root_st.st_ino)])
+
+        # (path, stat result of the directory)
+        stack = [(root, root_st)]
+        while stack:
+            dirpath, dir_st = stack.pop()
+            entries = None
+            try:
+                if listing_cache is not None:
+                    entries = listing_cache.get(dirpath, dir_st)
+                if entries is None:
+                    # is_symlink() is answered from the directory listing itself
+                    with os.scandir(dirpath) as it:
+                        entries = [(entry.name, entry.is_symlink()) for entry in it]
+                    if listing_cache is not None:
+                        listing_cache.put(dirpath, dir_st, entries)
+            except OSError as e:
+                self.logger.log(LogLevel.WARNING, f"could not list directory {dirpath} -- {e}")
+                continue
+
+            subdirs = []
+            for name, is_symlink in entries:
+                path = os.path.join(dirpath, name)
+                if rules is not None:
+                    relative_path = path[len(root) + 1:]
+                    if rules.excluded(relative_path):
+                        self.count_excluded(path)
+                        continue
+                try:
+                    if is_symlink and not self.follow_symlinks:
+                        st = os.lstat(path)
+                    else:
+                        st = os.stat(path)
+                except FileNotFoundError:
+                    # a broken symlink, or the entry has vanished
+                    continue
+                except OSError as e:
+                    self.logger.log(LogLevel.WARNING, f"could not stat {path} -- {e}")
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    walk = (st.st_dev, st.st_ino) not in visited
+                    if is_symlink:
+                        realpath = os.path.realpath(path)
+                        # skip symlinks pointing outside of path_limit
+                        if not realpath.startswith(pkg_path):
+                            continue
+                        if realpath == real_root or realpath.startswith(real_root + '/'):
+                            walk = False
+                    if walk:
+                        visited.add((st.st_dev, st.st_ino))
+                        subdirs.append((path, st))
+                else:
+                    if is_symlink and self.follow_symlinks:
+                        # skip symlinks pointing outside of path_limit
+                        if not os.path.realpath(path).startswith(pkg_path):
+                            continue
+                    if rules is not None and not rules.included(relative_path):
+                        self.stats['excluded_files'] += 1
+                        self.stats['excluded_bytes'] += st.st_size
+                        continue
+                yield path, st
+
+            stack.extend(reversed(subdirs))
+
+    # an excluded entry costs an lstat() to report its size, the contents of
+    # an excluded directory are not looked at
+    def count_excluded(self, path):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return
+        if stat.S_ISDIR(st.st_mode):
+            self.stats['excluded_dirs'] += 1
+        else:
+            self.stats['excluded_files'] += 1
+            self.stats['excluded_bytes'] += st.st_size
+
+    # walks the package in the calling thread and hands the files to hash to
+    # the pool in chunks of chunk_size with map_async(), at most
+    # max_queued_files of them are in flight so the walk can't run
+    # arbitrarily far ahead of the hashing. Since nothing runs in the pool's
+    # task handler thread, packages hashed from several threads (see
+    # LocalRunner) share the pool's workers chunk by chunk.
+    #
+    # the workers only receive (seq, path, algorithm, tier, segment) for regular
+    # files that need to be read, rows are built here and yielded as (seq, key,
+    # row, rehashed) where rehashed is None for anything but a regular file.
+    # Files that vanish before a worker opens them are not yielded.
+    #
+    # prev_file_tbl holds the baseline rows, when comparing against them
+    # (accept=False) each file is hashed with the algorithm and tier of its
+    # baseline row, otherwise with the configured ones; with fast_verify their
+    # stat tuples are used to skip unchanged files (but sampled files, so that
+    # their segment rotation goes on). Sampled files verify their segment
+    # number runs (mod the number of segments), all of them on accept.
+    # Fully hashed files are looked up in and added to hash_cache if set, and
+    # listing_cache and rules are passed on to walk_package().
+    def hash_package(self, pool, root, base_path, prev_file_tbl=None, fast_verify=False, accept=False, runs=0, hash_cache=None, listing_cache=None, rules=None):
+
+        if accept:
+            segment = None
+        else:
+            segment = runs
+
+        # (seq, filepath, st, algorithm, tier, prev_row) of the files of the
+        # chunk being filled
+        chunk = []
+        # (AsyncResult, files) of the chunks handed to the pool, oldest first
+        inflight = collections.deque()
+        queued = 0
+
+        def submit():
+            nonlocal chunk, queued
+            if len(chunk) > 0:
+                tasks = [(seq, filepath, algorithm, tier, segment) for seq, filepath, st, algorithm, tier, prev_row in chunk]
+                inflight.append((pool.map_async(hash_file, tasks, len(tasks)), chunk))
+                queued += len(chunk)
+                chunk = []
+
+        # yields the rows of the finished chunks, waiting for the oldest ones
+        # while more than limit files are in flight
+        def collect(limit):
+            nonlocal queued
+            while len(inflight) > 0 and (inflight[0][0].ready() or queued > limit):
+                result, files = inflight.popleft()
+                queued -= len(files)
+                for (seq, sha256, segment_hashes), (seq, filepath, st, algorithm, tier, prev_row) in zip(result.get(), files):
+                    if sha256 is None:
+                        # vanished since it was listed, like a file removed
+                        # before the walk it has no row
+                        continue
+                    if hash_cache is not None and not is_sampled(tier):
+                        hash_cache.put(st, algorithm, sha256)
+                    key, new_row = self.process_file(filepath, st, sha256, algorithm, tier)
+                    new_row['segment_hashes'] = self.merge_segments(key, prev_row, segment_hashes, segment)
+                    yield (seq, key, new_row, True)
+
+        for seq, (filepath, st) in enumerate(self.walk_package(root, listing_cache, rules)):
+            if not stat.S_ISREG(st.st_mode):
+                yield (seq,) + self.process_file(filepath, st, "", None) + (None,)
+                continue
+            algorithm = self.hash_algorithm
+            tier = self.get_tier(st.st_size)
+            prev_row = None
+            if prev_file_tbl is not None:
+                relative_path = filepath[len(base_path):].lstrip('/')
+                prev_row = prev_file_tbl.get((base_path, relative_path))
+                if prev_row is not None:
+                    prev_algorithm = prev_row.get('hash_algorithm') or DEFAULT_ALGORITHM
+                    prev_tier = prev_row.get('hash_tier') or FULL_TIER
+                    if prev_algorithm != self.hash_algorithm:
+                        self.stats['other_algorithm'] += 1
+                    if not accept:
+                        algorithm = prev_algorithm
+                        tier = prev_tier
+                    # a sampled file is still verified with its next
+                    # segment, or the rotation would never move on for it
+                    if fast_verify and prev_algorithm == algorithm and prev_tier == tier and self.stat_unchanged(prev_row, st) and (segment is None or not is_sampled(tier)):
+                        yield (seq,) + self.process_file(filepath, st, prev_row['content_hash'], algorithm, tier, prev_row.get('segment_hashes')) + (False,)
+                        continue
+            if is_sampled(tier):
+                self.stats['sampled'] += 1
+            elif hash_cache is not None:
+                content_hash = hash_cache.get(st, algorithm)
+                if content_hash is not None:
+                    yield (seq,) + self.process_file(filepath, st, content_hash, algorithm, tier) + (False,)
+                    continue
+            chunk.append((seq, filepath, st, algorithm, tier, prev_row))
+            if len(chunk) >= self.chunk_size:
+                submit()
+            yield from collect(self.max_queued_files)
+
+        submit()
+        yield from collect(0)
+
     def sanitize_identifier(self, string):
         import re
         
         # Allow only letters, digits, underscores, and hyphens
         return re.sub(r'[^a-zA-Z0-9._-]', '', string)
 
+    # the baseline rows are only needed before the scan if some files would
+    # not be hashed the way the configuration says: rows hashed with another
+    # algorithm or with the sampled tier, and with sample_threshold the files
+    # that are at least that large, since their baseline row may still be a
+    # full hash (the pickle format is always read in full anyway)
+    def baseline_rows_needed(self, filters=None):
+        if self.dbformat != 'sqlite3':
+            return True
+        query, params = self.filter_query("SELECT base_path FROM fileint", filters)
+        conditions = "COALESCE(hash_algorithm, ?) != ? OR COALESCE(hash_tier, ?) != ?"
+        params += [DEFAULT_ALGORITHM, self.hash_algorithm, FULL_TIER, FULL_TIER]
+        if self.sample_threshold is not None:
+            conditions += " OR file_size >= ?"
+            params.append(self.sample_threshold)
+        self.db_connect()
+        try:
+            found = self.cursor.execute(f"SELECT 1 FROM file WHERE base_path IN ({query}) AND ({conditions}) LIMIT 1", params).fetchone()
+        finally:
+            self.conn.close()
+        return found is not None
+
+    # appends the conditions for filters to query, the values are passed as
+    # parameters and the hierarchy names (which can't be) are sanitized
+    def filter_query(self, query, filters):
+        if not filters:
+            return query, []
+        conditions = [f"{self.sanitize_identifier(myfilter['hierarchy'])} = ?" for myfilter in filters]
+        return query + " WHERE " + " AND ".join(conditions), [myfilter['value'] for myfilter in filters]
+
     def delete(self, filters):
 
+        if self.dbformat == 'packed':
+            if not filters:
+                raise Exception(f"ERROR: no filters specified in FileInt::delete()")
+            base_paths = set(self.get_filter_matches(filters))
+            if len(base_paths) == 0:
+                self.logger.log(LogLevel.VERBOSE, f"INFO: In FileInt::delete(), no matching entries found in fileint, nothing to do")
+                return
+            self.logger.log(LogLevel.VERBOSE, f"removing the packages {base_paths} from the packed baseline")
+            self.write_packed_tbls({}, FileTable(), removed=base_paths)
+            return
+
         if self.dbformat != 'sqlite3':
-            raise Exception(f"ERROR: only sqlite3 is supported for deletion (dbformat: {self.dbformat})")
+            raise Exception(f"ERROR: only sqlite3 and packed are supported for deletion (dbformat: {self.dbformat})")
 
         # the fileint table is a list of package names
         # - a package is uniquely identified by the tuple of the hierarchy components plus the base_path
@@ -447,129 +1554,386 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
 
         # STEP 1: get set of base_path value(s) from db
 
-        get_bps_query = "SELECT base_path FROM fileint WHERE "
-        
-        conditions = []
-        for myfilter in filters:
-            h = self.sanitize_identifier(myfilter['hierarchy'])
-            v = self.sanitize_identifier(myfilter['value'])
-            conditions.append(f"{h} = \"{v}\"")
-
-        if len(conditions) == 0:
+        if not filters:
             raise Exception(f"ERROR: no filters specified in FileInt::delete()")
 
-        get_bps_query += " AND ".join(conditions)
+        if self.shard_dir is not None and self.shard is None:
+            for shard_file in self.shard_files(filters):
+                with self.use_shard(shard_file):
+                    self.delete(filters)
+                    empty = self.shard_empty()
+                if empty:
+                    self.logger.log(LogLevel.VERBOSE, f"removing the empty shard {shard_file}")
+                    self.del_db(shard_file)
+                    if os.path.exists(shard_file + '.lock'):
+                        os.remove(shard_file + '.lock')
+            return
+
+        get_bps_query, params = self.filter_query("SELECT base_path FROM fileint", filters)
 
         self.db_connect()
-        self.logger.log(LogLevel.VERBOSE, f"get_bps_query = {get_bps_query}")
-        data = self.cursor.execute(get_bps_query).fetchall()
+        self.logger.log(LogLevel.VERBOSE, f"get_bps_query = {get_bps_query} {params}")
+        data = self.cursor.execute(get_bps_query, params).fetchall()
         base_paths = set([row[0] for row in data])
         if len(base_paths) == 0:
             self.logger.log(LogLevel.VERBOSE, f"INFO: In FileInt::delete(), no matching entries found in fileint, nothing to do")
             return
 
         # STEP 2: remove file row(s) containing any of those base_path value(s)
-        file_rm_query = "DELETE FROM file WHERE " + " OR ".join([f"base_path = \"{base_path}\"" for base_path in base_paths])
-        self.logger.log(LogLevel.VERBOSE, f"file_rm_query = {file_rm_query}")
-        self.cursor.execute(file_rm_query)
+        self.logger.log(LogLevel.VERBOSE, f"removing the file rows of {base_paths}")
+        self.cursor.executemany("DELETE FROM file WHERE base_path = ?", [(base_path,) for base_path in base_paths])
+        self.cursor.executemany("DELETE FROM segment_rotation WHERE base_path = ?", [(base_path,) for base_path in base_paths])
+        self.cursor.executemany("DELETE FROM dir_digest WHERE base_path = ?", [(base_path,) for base_path in base_paths])
+        self.cursor.executemany("DELETE FROM baseline_delta WHERE base_path = ?", [(base_path,) for base_path in base_paths])
+        self.cursor.executemany("DELETE FROM baseline_generation WHERE base_path = ?", [(base_path,) for base_path in base_paths])
 
         # STEP3 3: remove fileint row(s) based on specified filter(s)
-        fileint_rm_query = "DELETE FROM fileint WHERE " + " AND ".join(conditions)
-        self.logger.log(LogLevel.VERBOSE, f"fileint_rm_query = {fileint_rm_query}")
-        self.cursor.execute(fileint_rm_query)
+        fileint_rm_query, params = self.filter_query("DELETE FROM fileint", filters)
+        self.logger.log(LogLevel.VERBOSE, f"fileint_rm_query = {fileint_rm_query} {params}")
+        self.cursor.execute(fileint_rm_query, params)
 
         self.db_save()
 
-    def read_paths(self, filters=None, accept=False):
+    # the packages with a baseline whose hash_of_blob predates the directory
+    # digests, these are verified with the old hash_of_blob until accepted
+    def legacy_blob_packages(self, filters=None):
+        if self.dbformat == 'packed':
+            with PackedBaseline(self.dbfile) as packed:
+                packages = [packed.package(i) for i in packed.find(dict([(myfilter['hierarchy'], myfilter['value']) for myfilter in (filters or [])]))]
+            return set([base_path for base_path, fileint_row, flags in packages if not flags & MERKLE])
+        query, params = self.filter_query("SELECT base_path FROM fileint", filters)
+        self.db_connect()
+        try:
+            rows = self.cursor.execute(f"SELECT base_path FROM ({query}) AS matched WHERE NOT EXISTS (SELECT 1 FROM dir_digest WHERE dir_digest.base_path = matched.base_path)", params).fetchall()
+        finally:
+            self.conn.close()
+        return set([row[0] for row in rows])
+
+    # the directories whose digest differs from the baseline of a package,
+    # None if the baseline has no directory digests
+    def changed_dirs(self, base_path, digests):
+        self.db_connect()
+        try:
+            prev_digests = dict(self.cursor.execute("SELECT relative_path, digest FROM dir_digest WHERE base_path = ?", (base_path,)).fetchall())
+        finally:
+            self.conn.close()
+        if len(prev_digests) == 0:
+            return None
+        return set([directory for directory in set(prev_digests) | set(digests) if prev_digests.get(directory) != digests.get(directory)])
+
+    # the shard of the package with the hierarchy values components, its path
+    # is made of those values (e.g. shard_dir/python/3.13.3.sql), so the shard
+    # directory is the catalog of the stored packages
+    def shard_file(self, components):
+        hierarchy = self.config['fileint']['hierarchy']
+        return os.path.join(self.shard_dir, *[components[component] for component in hierarchy]) + '.sql'
+
+    # the existing shards of the packages matching filters
+    def shard_files(self, filters=None):
+        values = dict([(myfilter['hierarchy'], myfilter['value']) for myfilter in (filters or [])])
+        pattern = [glob.escape(values[component]) if component in values else '*' for component in self.config['fileint']['hierarchy']]
+        return sorted(glob.glob(os.path.join(glob.escape(self.shard_dir), *pattern) + '.sql'))
+
+    # dbfile is the given shard within the with block
+    @contextlib.contextmanager
+    def use_shard(self, shard_file):
+        dbfile = self.dbfile
+        os.makedirs(os.path.dirname(shard_file), exist_ok=True)
+        self.dbfile = shard_file
+        self.shard = shard_file
+        try:
+            yield
+        finally:
+            self.dbfile = dbfile
+            self.shard = None
 
-        # used to avoid symlink duplicates for now, unconditionally, not heeding
-        # the config parameter yet
-        seen_paths = set()
+    def shard_empty(self):
+        self.db_connect()
+        try:
+            return self.cursor.execute("SELECT COUNT(*) FROM fileint").fetchone()[0] == 0
+        finally:
+            self.conn.close()
+
+    # moves the baseline of the package at base_path from dbfile into its new
+    # shard, so that setting shard_dir keeps the existing baselines. The rows
+    # are copied and removed from dbfile in one transaction, dbfile only keeps
+    # the discovery index (with shard_dir, nothing else reads it anyway).
+    def migrate_to_shard(self, base_path, shard_file):
+        if not os.path.exists(self.dbfile):
+            return
+        self.db_connect()
+        try:
+            found = self.cursor.execute("SELECT COUNT(*) FROM fileint WHERE base_path = ?", (base_path,)).fetchone()[0] > 0
+        finally:
+            self.conn.close()
+        if not found:
+            return
+        dbfile = self.dbfile
+        with self.use_shard(shard_file):
+            self.db_connect()
+            try:
+                self.cursor.execute("ATTACH DATABASE ? AS unsharded", (dbfile,))
+                for table in ('fileint', 'file', 'segment_rotation', 'dir_digest', 'baseline_generation', 'baseline_delta'):
+                    # the columns added by db_migrate() are in a different order
+                    columns = ", ".join([self.sanitize_identifier(row[1]) for row in self.cursor.execute(f"PRAGMA unsharded.table_info({table})").fetchall()])
+                    self.cursor.execute(f"INSERT OR REPLACE INTO main.{table} ({columns}) SELECT {columns} FROM unsharded.{table} WHERE base_path = ?", (base_path,))
+                    self.cursor.execute(f"DELETE FROM unsharded.{table} WHERE base_path = ?", (base_path,))
+                self.conn.commit()
+                self.cursor.execute("DETACH DATABASE unsharded")
+            finally:
+                self.conn.close()
+        self.logger.log(LogLevel.INFO, f"moved the baseline of {base_path} from {dbfile} to the shard {shard_file}")
+
+    # read_paths() with shard_dir: each package is read, then written to or
+    # compared with its own shard, and the results are merged
+    def read_sharded_paths(self, filters=None, accept=False, full_verify=False, base_paths=None):
+
+        hierarchy = self.config['fileint']['hierarchy']
+
+        packages = []
+        if base_paths is None:
+            for fpath, base_path, components, tree in self.iter_packages():
+                if all([components[myfilter['hierarchy']] == myfilter['value'] for myfilter in (filters or [])]):
+                    packages.append((base_path, components))
+        else:
+            components = dict([(myfilter['hierarchy'], myfilter['value']) for myfilter in (filters or [])])
+            packages = [(base_path, components) for base_path in base_paths]
+
+        owns_pool = self.pool is None
+        if owns_pool and len(packages) > 1:
+            self.open_pool()
+
+        # each package is read by a call of its own, aliases in other shards
+        # reuse the rows of the first one scanned
+        owns_trees = self.scanned_trees is None
+        if owns_trees:
+            self.scanned_trees = dict()
+
+        fileint_tbl = dict()
+        file_tbl = FileTable()
+        fileint_tbl_diffs, file_tbl_diffs = None, None
+        for base_path, components in packages:
+            if filters is None:
+                self.logger.log(LogLevel.INFO, f"new package {base_path}")
+            shard_file = self.shard_file(components)
+            if not os.path.exists(shard_file):
+                self.migrate_to_shard(base_path, shard_file)
+            package_filters = [{'hierarchy': component, 'value': components[component]} for component in hierarchy]
+            with self.use_shard(shard_file):
+                results = self.read_paths(package_filters, accept, full_verify, [base_path])
+            fileint_tbl.update(results[0])
+            file_tbl.update(results[1])
+            if results[2] is not None:
+                fileint_tbl_diffs = (fileint_tbl_diffs or []) + results[2]
+            if results[3] is not None:
+                file_tbl_diffs = (file_tbl_diffs or []) + results[3]
+
+        if owns_trees:
+            self.scanned_trees = None
+
+        if owns_pool:
+            self.close_pool()
+
+        return fileint_tbl, file_tbl, fileint_tbl_diffs, file_tbl_diffs
+
+    # with base_paths (e.g. from a Slurm job manifest), those directories are
+    # the packages and discovery is skipped, filters must then give every
+    # hierarchy component
+    def read_paths(self, filters=None, accept=False, full_verify=False, base_paths=None):
+
+        if self.shard_dir is not None and self.shard is None:
+            return self.read_sharded_paths(filters, accept, full_verify, base_paths)
+
+        self.stats = {'skipped': 0, 'rehashed': 0, 'other_algorithm': 0, 'sampled': 0, 'excluded_files': 0, 'excluded_bytes': 0, 'excluded_dirs': 0}
+        self.segment_mismatches = []
+
+        # without a pool from open_pool(), one is used for this call only
+        owns_pool = self.pool is None
+
+        # the baseline is read before the scan, so that each file is hashed with
+        # the algorithm of its baseline row and, with fast verify, files with an
+        # unchanged stat tuple don't have to be re-hashed
+        fast_verify = self.fast_verify and not full_verify
+        prev_fileint_tbl, prev_file_tbl = None, None
+        # without a baseline to compare with, the rows are written as if
+        # accepted (all of the segments of sampled files are hashed)
+        new_baseline = not os.path.exists(self.dbfile) or not self.filters_matched(filters)
+        if not new_baseline:
+            if fast_verify or (not accept and self.baseline_rows_needed(filters)):
+                prev_fileint_tbl, prev_file_tbl = self.read_saved_tbls(filters)
+
+        # --full-verify reads every file and directory
+        hash_cache, listing_cache = None, None
+        if not full_verify:
+            hash_cache = self.hash_cache
+            listing_cache = self.listing_cache
+
+        # hash_of_blob is the root of the directory digests, except for the
+        # baselines written before them (and the pickle format, which has no
+        # place to store them)
+        legacy_packages = set()
+        if not accept and self.dbformat in ('sqlite3', 'packed') and os.path.exists(self.dbfile) and self.filters_matched(filters):
+            legacy_packages = self.legacy_blob_packages(filters)
+        dir_tbl = dict()
+
+        # packages with sampled files verify their next segment
+        runs = {}
+        if not accept and prev_file_tbl is not None:
+            runs = self.advance_rotation(set([key[0] for key in prev_file_tbl if is_sampled(prev_file_tbl[key].get('hash_tier'))]))
 
         h = len(self.config['fileint']['hierarchy'])
         label_str = ", ".join(self.config['fileint']['hierarchy'])
         placeholder_str = ", ".join(["?" for i in self.config['fileint']['hierarchy']])
 
         fileint_tbl = dict()
-        file_tbl = dict()
+        file_tbl = FileTable()
+
+        # package trees scanned in this call (or since scanned_trees was set),
+        # ((dev, inode), rules) -> (base_path, rows, directory digests,
+        # hash_of_blob, legacy), an alias of one of them (with no_duplicates
+        # off) reuses its rows if the same rules apply to it. The rows only
+        # depend on the tree as long as each file isn't hashed according to
+        # its own baseline row.
+        trees = self.scanned_trees if self.scanned_trees is not None else dict()
+        tree_rows = prev_file_tbl is None or accept
+
+        if base_paths is None:
+            packages = self.iter_packages()
+        else:
+            packages = self.given_packages(base_paths, filters)
 
-        for search_path in self.config['general']['base']:
-            if h == 1:
-                files = pathlib.Path(search_path).iterdir()
-            else:
-                files = pathlib.Path(search_path).glob("/".join(h * ["*"]))
-            for fpath in files:
-                metadata = []
-                fpath = str(pathlib.Path(fpath))
-                # # using resolve here means that if two packages point to eachother, there will only be one entry
-                # # not doing so, means that they are treated like entirely unique directories
-                fpath = str(pathlib.Path(fpath).resolve())
-                if not pathlib.Path(fpath).is_dir():
-                    continue
-                if (fpath not in self.config['general']['base']) and (fpath not in seen_paths):
-                    seen_paths.add(fpath)
-                    if filters is None:
-                        self.logger.log(LogLevel.INFO, f"new package {fpath}")
-                    if self.config['fileint']['hierarchy'] is not None and len(self.config['fileint']['hierarchy']) > 0:
-                        base_path = fpath
-
-                        new_row = {'hash_of_blob': ''}
-
-                        i = 0
-                        for component in fpath.split("/")[-h:]:
-                            new_row[self.config['fileint']['hierarchy'][i]] = component
-                            i += 1
-
-                        matches_filter = True
-                        for myfilter in filters:
-                            if myfilter['value'] != new_row[myfilter['hierarchy']]:
-                                matches_filter = False
-                                break
-
-                        if matches_filter:
-                            fileint_tbl[base_path] = new_row
-                        else:
-                            continue
+        for fpath, base_path, components, tree in packages:
 
-                    self.base_path = base_path
+            new_row = {'hash_of_blob': ''}
+            new_row.update(components)
 
-                    if self.path_limit is not None:
-                        pkg_path = pathlib.Path(self.path_limit)
-                    else:
-                        pkg_path = '\0'
+            matches_filter = True
+            for myfilter in (filters or []):
+                if myfilter['value'] != new_row[myfilter['hierarchy']]:
+                    matches_filter = False
+                    break
+            if not matches_filter:
+                continue
+
+            if filters is None:
+                self.logger.log(LogLevel.INFO, f"new package {base_path}")
+            fileint_tbl[base_path] = new_row
+
+            legacy = self.dbformat == 'pickle' or base_path in legacy_packages
+
+            rules = None
+            if self.path_rules is not None:
+                rules = self.path_rules.for_package(":".join([new_row[component] for component in self.config['fileint']['hierarchy']]))
+            tree = (tree, rules)
+
+            if tree in trees and tree_rows:
+                other, rows, digests, hash_of_blob, other_legacy = trees[tree]
+                if legacy == other_legacy:
+                    self.logger.log(LogLevel.VERBOSE, f"{base_path} is an alias of {other}, reusing its rows")
+                    file_tbl.set_package(base_path, rows)
+                    if digests is not None:
+                        dir_tbl[base_path] = digests
+                    new_row['hash_of_blob'] = hash_of_blob
+                    continue
 
-                    with multiprocessing.Pool(self.pool_size) as p:
-                        
-                        # Create a list of file paths
-                        file_paths = [filepath for filepath in pathlib.Path(fpath).rglob('*') if pathlib.Path(filepath).exists()]
-                        file_paths = [filepath for filepath in file_paths if not (filepath.is_symlink() and not str(filepath.resolve()).startswith(str(pkg_path)))]
+            self.base_path = base_path
+
+            # Hash files as they are discovered, the results arrive
+            # in no particular order
+            ordered = []
+            for (seq, key, file_row, rehashed) in self.hash_package(self.open_pool(), base_path, base_path, prev_file_tbl, fast_verify, accept or new_baseline, runs.get(base_path, 0), hash_cache, listing_cache, rules):
+                file_tbl[key] = file_row
+                ordered.append((seq, key[1]))
+                if rehashed:
+                    self.stats['rehashed'] += 1
+                elif rehashed is not None:
+                    self.stats['skipped'] += 1
+
+            rows = file_tbl.package(base_path)
+            if not legacy:
+                dir_tbl[base_path] = self.merkle_digests(rows)
+                new_row['hash_of_blob'] = dir_tbl[base_path]['']
+            else:
+                # the old hash_of_blob depends on the traversal
+                # order, restore it
+                ordered.sort(key=lambda x: x[0])
+                metadata = ([rows[relative_path][column] for column in FILE_COLUMNS] for seq, relative_path in ordered)
+                new_row['hash_of_blob'] = self.sha256_checksum_metadata(metadata)
+
+            if tree_rows:
+                trees[tree] = (base_path, rows, dir_tbl.get(base_path), new_row['hash_of_blob'], legacy)
+
+        if owns_pool:
+            self.close_pool()
+
+        if hash_cache is not None:
+            self.logger.log(LogLevel.INFO, f"Hash cache: {hash_cache.stats['hits']} hits, {hash_cache.stats['misses']} misses")
+            hash_cache.evict()
+            hash_cache.close()
+
+        if listing_cache is not None:
+            self.logger.log(LogLevel.INFO, f"Listing cache: {listing_cache.stats['hits']} directories unchanged, {listing_cache.stats['misses']} listed")
+            listing_cache.evict()
+            listing_cache.close()
+
+        if self.stats['other_algorithm'] > 0:
+            if accept:
+                self.logger.log(LogLevel.INFO, f"{self.stats['other_algorithm']} files were re-hashed with {self.hash_algorithm}, replacing the algorithm of their baseline row")
+            else:
+                self.logger.log(LogLevel.INFO, f"{self.stats['other_algorithm']} files were verified with the algorithm of their baseline row instead of {self.hash_algorithm} (they switch when the package is accepted again)")
 
-                        # Process each file in parallel
-                        results = p.map(self.process_file, file_paths)
+        if self.stats['sampled'] > 0:
+            if accept or new_baseline:
+                self.logger.log(LogLevel.INFO, f"{self.stats['sampled']} files were fingerprinted by sampling, with all of their segments hashed")
+            else:
+                self.logger.log(LogLevel.INFO, f"{self.stats['sampled']} files were verified by sampling and one full segment each")
+
+        if fast_verify:
+            self.logger.log(LogLevel.INFO, f"Fast verify: {self.stats['skipped']} files skipped (stat unchanged), {self.stats['rehashed']} files re-hashed")
 
-                        # Collect the results into file_tbl and metadata
-                        for (key, new_row) in results:
-                            file_tbl[key] = new_row
-                            metadata.append(list(new_row.values()))
+        if self.path_rules is not None:
+            self.logger.log(LogLevel.INFO, f"Excluded by include/exclude rules: {self.stats['excluded_files']} files ({self.stats['excluded_bytes']} bytes), {self.stats['excluded_dirs']} directories not walked")
 
-                    metadata_hash = self.sha256_checksum_metadata(metadata)
-                    fileint_tbl[base_path]['hash_of_blob'] = metadata_hash
-                
         if not os.path.exists(self.dbfile) or not self.filters_matched(filters):
-            self.write_tbls(fileint_tbl, file_tbl)
+            self.write_tbls(fileint_tbl, file_tbl, dir_tbl)
             fileint_tbl_diffs = None
             file_tbl_diffs = None
         elif os.path.exists(self.dbfile) and accept:
-            self.write_tbls(fileint_tbl, file_tbl)
+            self.write_tbls(fileint_tbl, file_tbl, dir_tbl)
             fileint_tbl_diffs = None
             file_tbl_diffs = None
         else:
 
             self.logger.log(LogLevel.INFO, f"{self.dbfile} does exist, comparing with baseline")
-            prev_fileint_tbl, prev_file_tbl = self.read_saved_tbls(filters)
-
-            fileint_tbl_diffs = self.tbl_compare(prev_fileint_tbl, fileint_tbl)
-            file_tbl_diffs = self.tbl_compare(prev_file_tbl, file_tbl)
+            if self.dbformat == 'sqlite3':
+                # the file rows are compared against a cursor over the
+                # baseline, package by package
+                if prev_fileint_tbl is None:
+                    prev_fileint_tbl, _ = self.read_saved_tbls(filters, files=False)
+                fileint_tbl_diffs = self.tbl_compare(prev_fileint_tbl, fileint_tbl)
+                file_tbl_diffs = []
+                for base_path in sorted(set(prev_fileint_tbl) | set(fileint_tbl)):
+                    # with directory digests on both sides, only the entries
+                    # of the directories whose digest changed are compared
+                    dirs = None
+                    if base_path in dir_tbl:
+                        dirs = self.changed_dirs(base_path, dir_tbl[base_path])
+                    if dirs is not None and len(dirs) == 0:
+                        continue
+                    rows = file_tbl.package(base_path).items()
+                    if dirs is not None:
+                        # the deepest ones, all of their parents change with them
+                        subtrees = sorted([directory for directory in dirs if not any(other != directory and other.startswith(directory) for other in dirs)])
+                        self.logger.log(LogLevel.INFO, f"Deepest changed directories of {base_path}: {', '.join([directory or '/' for directory in subtrees])}")
+                        rows = [(relative_path, row) for relative_path, row in rows if relative_path[:relative_path.rfind('/') + 1] in dirs]
+                    file_tbl_diffs.extend(self.stream_compare(base_path, sorted(rows, key=lambda x: x[0]), dirs=dirs))
+            else:
+                if prev_file_tbl is None:
+                    prev_fileint_tbl, prev_file_tbl = self.read_saved_tbls(filters)
+                fileint_tbl_diffs = self.tbl_compare(prev_fileint_tbl, fileint_tbl)
+                file_tbl_diffs = self.tbl_compare(prev_file_tbl, file_tbl)
+            for key in self.segment_mismatches:
+                file_tbl_diffs.append({'A': prev_file_tbl[key], 'B': file_tbl[key], 'mismatch_type': MismatchType.WRONG_VALUE, 'row': key, 'column': 'segment_hashes'})
 
             self.print_diffs(fileint_tbl_diffs, "FILEINT_TBL_DIFFS")
             self.print_diffs(file_tbl_diffs, "FILE_TBL_DIFFS")
@@ -580,83 +1944,252 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
 
         return fileint_tbl, file_tbl, fileint_tbl_diffs, file_tbl_diffs
 
-    def del_db(self):
-        if os.path.exists(self.dbfile):
-            self.logger.log(LogLevel.INFO, f"removing previous db: {self.dbfile}")
-            os.remove(self.dbfile)
+    def del_db(self, dbfile=None):
+        if dbfile is None:
+            dbfile = self.dbfile
+        if os.path.exists(dbfile):
+            self.logger.log(LogLevel.INFO, f"removing previous db: {dbfile}")
+            os.remove(dbfile)
+        # left behind by journal_mode: wal
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(dbfile + suffix):
+                os.remove(dbfile + suffix)
+
+    # yields (fpath, base_path, components, tree) for each package directory
+    # that matches the hierarchy template under the configured base paths.
+    # fpath is the path as found, base_path the same path with only the base
+    # path resolved, components the hierarchy values and tree the (dev, inode)
+    # of the package directory.
+    #
+    # With no_duplicates, a package directory whose tree was already yielded
+    # (an alias, e.g. python/3 -> python/3.13.3) is skipped, real directories
+    # are yielded before aliases so that they are the ones kept.
+    def iter_packages(self, refresh=True):
+        for fpath, base_path, components, tree, duplicate in self.discover_packages(refresh):
+            if self.no_duplicates and duplicate:
+                self.logger.log(LogLevel.VERBOSE, f"skipping {fpath}, an alias of another package (no_duplicates)")
+                continue
+            yield fpath, base_path, components, tree
+
+    # returns [(fpath, base_path, components, tree, duplicate)] in enumerate
+    # order, duplicate is set for the aliases of a tree listed before
+    #
+    # With sqlite3, the result is kept in the database as a discovery index.
+    # Listing a directory above the package directories (the base paths and
+    # the hierarchy levels but the last) gives the same entries while its
+    # inode, mtime and ctime are unchanged, so a refresh only stats those
+    # directories and lists the ones that changed. Without refresh, the index
+    # is read as is (e.g. by Slurm array tasks, it was refreshed when the
+    # array was submitted).
+    def discover_packages(self, refresh=True):
+
+        hierarchy = self.config['fileint']['hierarchy']
+        h = len(hierarchy)
+
+        use_index = self.dbformat == 'sqlite3'
+
+        # path -> (stat key, entries) and parent -> [package rows]
+        stored_dirs = dict()
+        stored_pkgs = dict()
+        if use_index:
+            self.db_connect()
+            try:
+                if not refresh:
+                    packages = [(row[0], row[1], dict(zip(hierarchy, json.loads(row[2]))), (row[3], row[4]), bool(row[5])) for row in
+                                self.cursor.execute("SELECT fpath, base_path, components, dev, ino, duplicate FROM discovery_pkg ORDER BY seq")]
+                    if len(packages) > 0:
+                        return packages
+                for row in self.cursor.execute("SELECT path, dev, ino, mtime_ns, ctime_ns, entries FROM discovery_dir"):
+                    stored_dirs[row[0]] = (tuple(row[1:5]), json.loads(row[5]))
+                for row in self.cursor.execute("SELECT parent, fpath, base_path, components, dev, ino, alias FROM discovery_pkg ORDER BY seq"):
+                    stored_pkgs.setdefault(row[0], []).append(tuple(row[1:]))
+            finally:
+                self.conn.close()
+
+        bases = set([os.path.realpath(search_path) for search_path in self.config['general']['base']])
+
+        new_dirs = dict()
+        listed = 0
+        # (parent, fpath, base_path, components, dev, ino, alias)
+        candidates = []
+
+        for search_path in self.config['general']['base']:
+            real_search_path = os.path.realpath(search_path)
+
+            found = []
+            parents = [search_path]
+            for level in range(h):
+                last = level == h - 1
+                next_parents = []
+                for dirpath in parents:
+                    try:
+                        st = os.stat(dirpath)
+                    except OSError:
+                        continue
+                    key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns)
+                    # the entries of the last level are the package rows
+                    if dirpath in stored_dirs and stored_dirs[dirpath][0] == key and (stored_dirs[dirpath][1] is None) == last:
+                        entries = stored_dirs[dirpath][1]
+                        pkgs = stored_pkgs.get(dirpath, [])
+                    else:
+                        listed += 1
+                        try:
+                            names = sorted(os.listdir(dirpath))
+                        except OSError as e:
+                            self.logger.log(LogLevel.WARNING, f"could not list directory {dirpath} -- {e}")
+                            continue
+                        entries = None if last else []
+                        pkgs = []
+                        for name in names:
+                            fpath = os.path.join(dirpath, name)
+                            try:
+                                entry_st = os.stat(fpath)
+                            except OSError:
+                                continue
+                            if not stat.S_ISDIR(entry_st.st_mode):
+                                continue
+                            if not last:
+                                entries.append(name)
+                                continue
+                            relative_path = os.path.relpath(fpath, search_path)
+                            base_path = os.path.join(real_search_path, relative_path)
+                            components = relative_path.split("/")[-h:]
+                            pkgs.append((fpath, base_path, json.dumps(components), entry_st.st_dev, entry_st.st_ino,
+                                         int(os.path.realpath(fpath) != base_path)))
+                    # a directory modified this recently may still change
+                    # within the same timestamp, it is listed again next time
+                    if time.time() - max(st.st_mtime_ns, st.st_ctime_ns) / 1e9 < RACY_SECONDS:
+                        key = (None, None, None, None)
+                    new_dirs[dirpath] = (key, entries)
+                    if last:
+                        found.extend([(dirpath,) + pkg for pkg in pkgs])
+                    else:
+                        next_parents.extend([os.path.join(dirpath, name) for name in entries])
+                parents = next_parents
+
+            # aliases last, so that the real directories are the ones kept
+            found.sort(key=lambda x: x[6])
+            candidates.extend(found)
+
+        packages = []
+        rows = []
+        seen_paths = set()
+        seen_trees = set()
+        for parent, fpath, base_path, components, dev, ino, alias in candidates:
+            if base_path in bases or base_path in seen_paths:
+                continue
+            seen_paths.add(base_path)
+            tree = (dev, ino)
+            duplicate = tree in seen_trees
+            seen_trees.add(tree)
+            packages.append((fpath, base_path, dict(zip(hierarchy, json.loads(components))), tree, duplicate))
+            rows.append((len(rows), parent, fpath, base_path, components, dev, ino, alias, int(duplicate)))
+
+        self.logger.log(LogLevel.VERBOSE, f"package discovery: {len(new_dirs)} directories checked, {listed} listed")
+
+        if use_index and (listed > 0 or set(stored_dirs) != set(new_dirs)):
+            self.db_connect()
+            try:
+                with self.conn:
+                    self.cursor.execute("DELETE FROM discovery_dir")
+                    self.cursor.execute("DELETE FROM discovery_pkg")
+                    self.cursor.executemany("INSERT INTO discovery_dir (path, dev, ino, mtime_ns, ctime_ns, entries) VALUES (?, ?, ?, ?, ?, ?)",
+                                            [(path,) + key + (json.dumps(entries),) for path, (key, entries) in new_dirs.items()])
+                    self.cursor.executemany("INSERT INTO discovery_pkg (seq, parent, fpath, base_path, components, dev, ino, alias, duplicate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            finally:
+                self.conn.close()
+
+        return packages
+
+    # yields the same tuples as iter_packages() for packages whose base_path
+    # is already known, with the hierarchy values given by filters
+    def given_packages(self, base_paths, filters):
+        components = dict([(myfilter['hierarchy'], myfilter['value']) for myfilter in (filters or [])])
+        for base_path in base_paths:
+            try:
+                st = os.stat(base_path)
+            except OSError as e:
+                self.logger.log(LogLevel.WARNING, f"could not stat package directory {base_path} -- {e}")
+                continue
+            if not stat.S_ISDIR(st.st_mode):
+                self.logger.log(LogLevel.WARNING, f"package directory {base_path} is not a directory")
+                continue
+            yield base_path, base_path, components, (st.st_dev, st.st_ino)
+
+    # returns {package_id: (dev, inode)} of the package directories, aliases
+    # of a tree have the same value
+    def get_package_trees(self, refresh=True):
+        hierarchy = self.config['fileint']['hierarchy']
+        return dict([(':'.join([components[component] for component in hierarchy]), tree) for fpath, base_path, components, tree in self.iter_packages(refresh)])
+
+    # returns {package_id: base_path} for the packages in the discovery index
+    def get_base_paths(self, refresh=True):
+        hierarchy = self.config['fileint']['hierarchy']
+        return dict([(':'.join([components[component] for component in hierarchy]), base_path) for fpath, base_path, components, tree in self.iter_packages(refresh)])
 
     # iterates through pre-configured paths, prints all paths that match the
     # hierarchy template
     def get_hierarchy(self, ignore_paths=None):
 
-        h = len(self.config['fileint']['hierarchy'])
-        label_str = ", ".join(self.config['fileint']['hierarchy'])
-        placeholder_str = ", ".join(["?" for i in self.config['fileint']['hierarchy']])
+        results = []
 
-        fileint_tbl = dict()
-        file_tbl = dict()
+        for fpath, base_path, new_row, tree in self.iter_packages():
+            self.logger.log(LogLevel.TRACE, f"new package {fpath}")
 
-        results = []
+            ignore = False
+            if ignore_paths is not None:
+                for ignore_path in ignore_paths:
+                    if fpath.startswith(ignore_path):
+                        ignore = True
 
-        seen_paths = set()
+            if not ignore:
+                results.append(new_row)
 
-        for search_path in self.config['general']['base']:
-            if h == 1:
-                files = pathlib.Path(search_path).iterdir()
-            else:
-                files = pathlib.Path(search_path).glob("/".join(h * ["*"]))
-            for fpath in files:
-                metadata = []
-                fpath = str(pathlib.Path(fpath))
-                # # using resolve here means that if two packages point to eachother, there will only be one entry
-                # # not doing so, means that they are treated like entirely unique directories
-                # fpath = str(pathlib.Path(fpath).resolve())
-                if not pathlib.Path(fpath).is_dir():
-                    continue
-                if (fpath not in self.config['general']['base']) and (fpath not in seen_paths):
-                    seen_paths.add(fpath)
-                    self.logger.log(LogLevel.TRACE, f"new package {fpath}")
-                    if self.config['fileint']['hierarchy'] is not None and len(self.config['fileint']['hierarchy']) > 0:
+        return results
 
-                        base_path = fpath
+    # returns {package_id: total bytes} according to the stored baselines, used
+    # to schedule the largest packages first
+    def get_package_sizes(self):
 
-                        new_row = dict()
+        sizes = dict()
 
-                        i = 0
-                        for component in fpath.split("/")[-h:]:
-                            new_row[self.config['fileint']['hierarchy'][i]] = component
-                            i += 1
+        if self.shard_dir is not None and self.shard is None:
+            for shard_file in self.shard_files():
+                with self.use_shard(shard_file):
+                    sizes.update(self.get_package_sizes())
+            return sizes
 
-                        ignore = False
-                        if ignore_paths is not None:
-                            for ignore_path in ignore_paths:
-                                if base_path.startswith(ignore_path):
-                                    ignore = True
+        hierarchy = self.config['fileint']['hierarchy']
+        if self.dbformat != 'sqlite3' or not os.path.exists(self.dbfile) or not hierarchy:
+            return sizes
 
-                        if not ignore:
-                            results.append(new_row)
+        self.db_connect()
 
-        return results
+        columns = ", ".join([f"fileint.{component}" for component in hierarchy])
+        query = f"SELECT {columns}, SUM(file.file_size) FROM fileint JOIN file ON file.base_path = fileint.base_path GROUP BY fileint.base_path"
+        self.logger.log(LogLevel.TRACE, f"package size query: {query}")
+        for row in self.cursor.execute(query).fetchall():
+            sizes[':'.join(row[:-1])] = row[-1] or 0
+
+        self.conn.close()
+
+        return sizes
 
     def filters_matched(self, filters=None):
         if filters is None:
             return True
 
+        if self.dbformat == 'packed':
+            return len(self.get_filter_matches(filters)) > 0
+
         self.db_connect()
         self.cursor = self.conn.cursor()
         
-        fi_query = "SELECT COUNT(*) FROM fileint WHERE "
-        filters_i = 1
-        for myfilter in filters:
-            fi_query += f"{myfilter['hierarchy']} = \"{myfilter['value']}\""
-            if len(filters) == filters_i:
-                break
-            fi_query += " AND "
-            filters_i += 1
-
-        self.logger.log(LogLevel.VERBOSE, f"fi_query_count: {fi_query}")
-
-        self.cursor.execute(fi_query)
+        fi_query, params = self.filter_query("SELECT COUNT(*) FROM fileint", filters)
+
+        self.logger.log(LogLevel.VERBOSE, f"fi_query_count: {fi_query} {params}")
+
+        self.cursor.execute(fi_query, params)
         fetch = self.cursor.fetchall()
         nonzero = False
         try:
@@ -670,19 +2203,31 @@ base_path TEXT NOT NULL PRIMARY KEY,"""
 
     def get_filter_matches(self, filters):
 
+        if self.shard_dir is not None and self.shard is None:
+            results = []
+            for shard_file in self.shard_files(filters):
+                with self.use_shard(shard_file):
+                    results.extend(self.get_filter_matches(filters))
+            return results
+
+        if self.dbformat == 'packed':
+            # including the packages not written yet
+            results = []
+            if self.packed_writes is not None:
+                results = self.packed_writes.find(filters)
+            if not os.path.exists(self.dbfile):
+                return results
+            with PackedBaseline(self.dbfile) as packed:
+                results.extend([base_path for base_path in [packed.package(i)[0] for i in packed.find(dict([(myfilter['hierarchy'], myfilter['value']) for myfilter in (filters or [])]))]
+                                if base_path not in results])
+            return results
+
         self.db_connect()
         self.cursor = self.conn.cursor()
         
-        fi_query = "SELECT base_path FROM fileint WHERE "
-        filters_i = 1
-        for myfilter in filters:
-            fi_query += f"{myfilter['hierarchy']} = \"{myfilter['value']}\""
-            if len(filters) == filters_i:
-                break
-            fi_query += " AND "
-            filters_i += 1
-
-        self.cursor.execute(fi_query)
+        fi_query, params = self.filter_query("SELECT base_path FROM fileint", filters)
+
+        self.cursor.execute(fi_query, params)
         fetch = self.cursor.fetchall()
 
         results = []
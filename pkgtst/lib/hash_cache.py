@@ -0,0 +1,149 @@
+# hash_cache - persistent content hash cache keyed by inode
+
+# Hardlinked trees, bind mounts and version aliases make the same inode show
+# up under several paths and packages. The cache maps (st_dev, st_ino, size,
+# mtime_ns, ctime_ns, algorithm) to the content hash of a regular file, so
+# that an inode is only read once until it changes. ctime can't be set from
+# user space, so any modification of the inode (including a restored mtime)
+# misses the cache.
+#
+# A file modified within RACY_SECONDS of being hashed may change again
+# without a new timestamp (coarse on Lustre and NFS), its hash is not stored.
+#
+# The cache is an SQLite database that may be shared by concurrent tests and
+# by Slurm array tasks, lookups go to the database and new entries are
+# written in batches by flush(). The number of entries is kept up to date by
+# triggers, so eviction doesn't have to count them.
+
+import time
+import sqlite3
+import threading
+
+from pkgtst.lib.logger import Logger
+from pkgtst.lib.logger import LogLevel
+from pkgtst.lib.listing_cache import RACY_SECONDS
+
+# seconds to wait for another process holding the write lock
+DB_TIMEOUT = 300
+
+# entries are only written back every FLUSH_ROWS lookups/inserts
+FLUSH_ROWS = 10000
+
+class HashCache:
+
+    def __init__(self, cache_file, max_age=None, max_entries=None, config_path=None):
+        self.cache_file = cache_file
+        # in days, entries not used for longer than this are evicted
+        self.max_age = max_age
+        # least recently used entries beyond this are evicted
+        self.max_entries = max_entries
+        self.logger = Logger(config_path=config_path)
+        self.conn = None
+        # flush() may run from another thread than the lookups
+        self.lock = threading.Lock()
+        # key -> content_hash for entries added since the last flush()
+        self.new_entries = dict()
+        # keys that were found in the database since the last flush()
+        self.used = set()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.cache_file, timeout=DB_TIMEOUT, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS hash_cache (
+                    dev INT NOT NULL,
+                    ino INT NOT NULL,
+                    size INT NOT NULL,
+                    mtime_ns INT NOT NULL,
+                    ctime_ns INT NOT NULL,
+                    algorithm TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    last_used INT NOT NULL,
+                    PRIMARY KEY (dev, ino, size, mtime_ns, ctime_ns, algorithm)
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS hash_cache_last_used ON hash_cache (last_used)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS hash_cache_count (entries INT NOT NULL)")
+            self.conn.commit()
+            # the count of a cache created before it is taken once, under the
+            # write lock so that no entry is added in between
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("CREATE TRIGGER IF NOT EXISTS hash_cache_insert AFTER INSERT ON hash_cache BEGIN UPDATE hash_cache_count SET entries = entries + 1; END")
+            self.conn.execute("CREATE TRIGGER IF NOT EXISTS hash_cache_delete AFTER DELETE ON hash_cache BEGIN UPDATE hash_cache_count SET entries = entries - 1; END")
+            self.conn.execute("INSERT INTO hash_cache_count (entries) SELECT (SELECT COUNT(*) FROM hash_cache) WHERE NOT EXISTS (SELECT 1 FROM hash_cache_count)")
+            self.conn.commit()
+        return self.conn
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def make_key(self, st, algorithm):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns, algorithm)
+
+    # returns the content hash of the file with stat result st, or None
+    def get(self, st, algorithm):
+        key = self.make_key(st, algorithm)
+        with self.lock:
+            content_hash = self.new_entries.get(key)
+            if content_hash is None:
+                row = self.connect().execute("SELECT content_hash FROM hash_cache WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND ctime_ns = ? AND algorithm = ?", key).fetchone()
+                if row is not None:
+                    content_hash = row[0]
+                    self.used.add(key)
+            if content_hash is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+            pending = len(self.new_entries) + len(self.used)
+        if pending >= FLUSH_ROWS:
+            self.flush()
+        return content_hash
+
+    def put(self, st, algorithm, content_hash):
+        if time.time() - max(st.st_mtime_ns, st.st_ctime_ns) / 1e9 < RACY_SECONDS:
+            return
+        with self.lock:
+            self.new_entries[self.make_key(st, algorithm)] = content_hash
+
+    # writes the new entries and the last use of the entries that were hit in
+    # one transaction
+    def flush(self):
+        with self.lock:
+            if len(self.new_entries) == 0 and len(self.used) == 0:
+                return
+            now = int(time.time())
+            conn = self.connect()
+            with conn:
+                # not INSERT OR REPLACE, the delete of a replaced row would
+                # not go through the count trigger
+                conn.executemany("UPDATE hash_cache SET content_hash = ?, last_used = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND ctime_ns = ? AND algorithm = ?",
+                                 [(content_hash, now) + key for key, content_hash in self.new_entries.items()])
+                conn.executemany("INSERT OR IGNORE INTO hash_cache (dev, ino, size, mtime_ns, ctime_ns, algorithm, content_hash, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [key + (content_hash, now) for key, content_hash in self.new_entries.items()])
+                conn.executemany("UPDATE hash_cache SET last_used = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ? AND ctime_ns = ? AND algorithm = ?",
+                                 [(now,) + key for key in self.used])
+            self.new_entries = dict()
+            self.used = set()
+
+    # drops entries older than max_age days, then the least recently used ones
+    # beyond max_entries
+    def evict(self):
+        self.flush()
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                evicted = 0
+                if self.max_age is not None:
+                    cutoff = int(time.time() - self.max_age * 86400)
+                    evicted += conn.execute("DELETE FROM hash_cache WHERE last_used < ?", (cutoff,)).rowcount
+                if self.max_entries is not None:
+                    count = conn.execute("SELECT entries FROM hash_cache_count").fetchone()[0]
+                    if count > self.max_entries:
+                        evicted += conn.execute("DELETE FROM hash_cache WHERE rowid IN (SELECT rowid FROM hash_cache ORDER BY last_used LIMIT ?)", (count - self.max_entries,)).rowcount
+        if evicted > 0:
+            self.logger.log(LogLevel.VERBOSE, f"evicted {evicted} entries from the hash cache at {self.cache_file}")
@@ -0,0 +1,206 @@
+# hasher - file content hashing for the fileint pool workers
+
+import os
+import hashlib
+import stat
+import mmap
+import threading
+
+from pkgtst.lib.logger import Logger
+from pkgtst.lib.logger import LogLevel
+
+# rows without an algorithm tag were hashed with this
+DEFAULT_ALGORITHM = 'sha256'
+
+# An algorithm tag is a hashlib name, optionally followed by a digest size in
+# bytes for the variable-size blake2 digests (e.g. "sha256", "blake2b" or
+# "blake2b-32")
+def algorithm_tag(name, digest_size=None):
+    if digest_size:
+        return f"{name}-{int(digest_size)}"
+    return name
+
+def new_digest(algorithm=None):
+    if not algorithm:
+        algorithm = DEFAULT_ALGORITHM
+    name, _, digest_size = algorithm.partition('-')
+    if digest_size:
+        if name not in ('blake2b', 'blake2s'):
+            raise ValueError(f"a digest size can only be set for blake2b or blake2s (algorithm: {algorithm})")
+        return getattr(hashlib, name)(digest_size=int(digest_size))
+    return hashlib.new(name)
+
+# The hash tier of a row says how much of the file content_hash covers, "full"
+# or "sampled-<stripes>-<stripe_size>-<segments>". A sampled content_hash is a
+# fingerprint of the size plus the head, the tail and <stripes> stripes of
+# <stripe_size> bytes at offsets derived from the size. On top of that, the
+# file is split into <segments> segments that are hashed on their own, each
+# test fully verifies one of them in turn.
+FULL_TIER = 'full'
+
+def sampled_tier(stripes, stripe_size, segments):
+    return f"sampled-{int(stripes)}-{int(stripe_size)}-{int(segments)}"
+
+def is_sampled(tier):
+    return tier is not None and tier.startswith('sampled-')
+
+def parse_tier(tier):
+    name, stripes, stripe_size, segments = tier.split('-')
+    return int(stripes), int(stripe_size), int(segments)
+
+# the offsets only depend on the size (and not on random's implementation), so
+# that a fingerprint stays valid across runs and Python versions
+def sample_offsets(size, stripes, stripe_size):
+    if size <= stripe_size:
+        return [0]
+    last = size - stripe_size
+    offsets = set([0, last])
+    for i in range(stripes):
+        seed = hashlib.sha256(f"{size}:{i}".encode()).digest()
+        offsets.add(int.from_bytes(seed[:8], 'little') % (last + 1))
+    return sorted(offsets)
+
+def segment_bounds(size, segments, i):
+    length = -(-size // segments)
+    return min(i * length, size), min((i + 1) * length, size)
+
+# The only state a pool worker needs, this is sent to each worker once when the
+# pool is created (instead of pickling a whole FileInt with every task)
+#
+# Files are read with readinto() into a buffer that is allocated once per
+# thread, files of at least mmap_threshold bytes are mmap'd and hashed without
+# any copy. hashlib releases the GIL while it hashes large buffers, so a
+# Hasher may also be used from a thread pool.
+class Hasher:
+
+    def __init__(self, block_size=1048576, mmap_threshold=67108864, config_path=None, algorithm=DEFAULT_ALGORITHM):
+        # raises for unknown algorithms before any worker starts
+        new_digest(algorithm)
+        self.algorithm = algorithm
+        self.block_size = block_size
+        self.mmap_threshold = mmap_threshold
+        self.logger = Logger(config_path=config_path)
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # the per-thread buffers are allocated again in each worker
+        state = self.__dict__.copy()
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def get_buffer(self):
+        buf = getattr(self.local, 'buf', None)
+        if buf is None:
+            buf = memoryview(bytearray(self.block_size))
+            self.local.buf = buf
+        return buf
+
+    # if st is set, it is used instead of stat'ing the file again
+    def checksum(self, filename, st=None, algorithm=None):
+        if st is not None:
+            is_file = stat.S_ISREG(st.st_mode)
+        else:
+            is_file = os.path.isfile(filename)
+        if is_file:
+            return self.file_digest(filename, algorithm)
+        else:
+            return ""
+
+    # the caller must have checked that filename is a regular file, algorithm
+    # defaults to the one this Hasher was created with. Returns None if the
+    # file has vanished since (e.g. removed or renamed in a live tree), the
+    # digest of what could be read if it can't be read.
+    def file_digest(self, filename, algorithm=None):
+        if algorithm is None:
+            algorithm = self.algorithm
+        digest = new_digest(algorithm)
+        try:
+            with open(filename, 'rb', buffering=0) as f:
+                size = os.fstat(f.fileno()).st_size
+                if self.mmap_threshold is not None and size >= self.mmap_threshold and size > 0:
+                    try:
+                        self.update_mmap(digest, f)
+                        return digest.hexdigest()
+                    except (OSError, ValueError) as e:
+                        # e.g. a file system without mmap support
+                        self.logger.log(LogLevel.VERBOSE, f"mmap failed for {filename}, reading it instead -- {e}")
+                        digest = new_digest(algorithm)
+                        f.seek(0)
+                self.update_readinto(digest, f)
+        except FileNotFoundError as e:
+            self.logger.log(LogLevel.VERBOSE, f"{filename} has vanished before it could be hashed -- {e}")
+            return None
+        except OSError as e:
+            self.logger.log(LogLevel.WARNING, f"caught exception, could not obtain hash for file {filename} -- {e}")
+        return digest.hexdigest()
+
+    # returns (fingerprint, segment hashes), the segment hashes are a list with
+    # an entry per segment, only the one given by segment is filled in unless
+    # segment is None (all of them, which reads the whole file). Both are None
+    # if the file has vanished, as with file_digest().
+    def sampled_digest(self, filename, algorithm, tier, segment=None):
+        stripes, stripe_size, segments = parse_tier(tier)
+        digest = new_digest(algorithm)
+        segment_hashes = [None] * segments
+        if segment is None:
+            indices = range(segments)
+        else:
+            indices = [segment % segments]
+        try:
+            with open(filename, 'rb', buffering=0) as f:
+                size = os.fstat(f.fileno()).st_size
+                digest.update(size.to_bytes(8, 'little'))
+                for offset in sample_offsets(size, stripes, stripe_size):
+                    digest.update(os.pread(f.fileno(), stripe_size, offset))
+                for i in indices:
+                    segment_digest = new_digest(algorithm)
+                    start, end = segment_bounds(size, segments, i)
+                    f.seek(start)
+                    self.update_readinto(segment_digest, f, end - start)
+                    segment_hashes[i] = segment_digest.hexdigest()
+        except FileNotFoundError as e:
+            self.logger.log(LogLevel.VERBOSE, f"{filename} has vanished before it could be hashed -- {e}")
+            return None, None
+        except OSError as e:
+            self.logger.log(LogLevel.WARNING, f"caught exception, could not obtain hash for file {filename} -- {e}")
+        return digest.hexdigest(), segment_hashes
+
+    # reads until EOF, or limit bytes if set
+    def update_readinto(self, digest, f, limit=None):
+        buf = self.get_buffer()
+        while limit is None or limit > 0:
+            if limit is not None and limit < len(buf):
+                n = f.readinto(buf[:limit])
+            else:
+                n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(buf[:n])
+            if limit is not None:
+                limit -= n
+
+    def update_mmap(self, digest, f):
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            digest.update(m)
+
+# set in each worker by init_worker()
+_hasher = None
+
+def init_worker(hasher):
+    global _hasher
+    _hasher = hasher
+
+# pool task: (seq, filepath, algorithm, tier, segment) -> (seq, hexdigest,
+# segment hashes or None), only regular files are sent, the hexdigest is None
+# for files that vanished after they were listed
+def hash_file(task):
+    seq, filepath, algorithm, tier, segment = task
+    if is_sampled(tier):
+        return (seq,) + _hasher.sampled_digest(filepath, algorithm, tier, segment)
+    return seq, _hasher.file_digest(filepath, algorithm), None
@@ -0,0 +1,121 @@
+# listing_cache - persistent directory listings keyed by directory timestamps
+
+# Package trees rarely change structurally, but every run lists every
+# directory again, which is a large share of the metadata traffic on NFS. The
+# cache stores the entries of each directory along with its inode, mtime and
+# ctime. Adding, removing or renaming an entry updates the mtime and ctime of
+# the directory, so while those are unchanged the stored listing is still
+# accurate and the directory doesn't have to be read. The entries themselves
+# are still stat'ed by the walker.
+#
+# Like the hash cache, this is an SQLite database that may be shared by
+# concurrent tests and Slurm array tasks, new listings are written in batches
+# by flush(). Within a process, each FileInt has a ListingCache of its own
+# that is only used by the thread walking its packages (see walk_package()).
+
+import time
+import json
+import sqlite3
+
+from pkgtst.lib.logger import Logger
+from pkgtst.lib.logger import LogLevel
+
+# seconds to wait for another process holding the write lock
+DB_TIMEOUT = 300
+
+# listings are only written back every FLUSH_ROWS lookups/inserts
+FLUSH_ROWS = 10000
+
+# a directory modified this recently (in seconds) may still change within the
+# same timestamp, its listing is not stored
+RACY_SECONDS = 2
+
+class ListingCache:
+
+    def __init__(self, cache_file, max_age=None, config_path=None):
+        self.cache_file = cache_file
+        # in days, listings not used for longer than this are evicted
+        self.max_age = max_age
+        self.logger = Logger(config_path=config_path)
+        self.conn = None
+        # path -> (key, entries) for listings added since the last flush()
+        self.new_entries = dict()
+        # paths that were found in the database since the last flush()
+        self.used = set()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.cache_file, timeout=DB_TIMEOUT)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS dir_listing (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    dev INT NOT NULL,
+                    ino INT NOT NULL,
+                    mtime_ns INT NOT NULL,
+                    ctime_ns INT NOT NULL,
+                    entries TEXT NOT NULL,
+                    last_used INT NOT NULL
+                )
+            """)
+            self.conn.commit()
+        return self.conn
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def make_key(self, st):
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns)
+
+    # returns the stored [(name, is_symlink), ...] of the directory at path
+    # with stat result st, or None if it isn't stored or has changed
+    def get(self, path, st):
+        key = self.make_key(st)
+        entries = None
+        if path in self.new_entries:
+            if self.new_entries[path][0] == key:
+                entries = self.new_entries[path][1]
+        else:
+            row = self.connect().execute("SELECT dev, ino, mtime_ns, ctime_ns, entries FROM dir_listing WHERE path = ?", (path,)).fetchone()
+            if row is not None and tuple(row[:4]) == key:
+                entries = [tuple(entry) for entry in json.loads(row[4])]
+                self.used.add(path)
+        if entries is None:
+            self.stats['misses'] += 1
+        else:
+            self.stats['hits'] += 1
+        if len(self.new_entries) + len(self.used) >= FLUSH_ROWS:
+            self.flush()
+        return entries
+
+    def put(self, path, st, entries):
+        if time.time() - max(st.st_mtime_ns, st.st_ctime_ns) / 1e9 < RACY_SECONDS:
+            return
+        self.new_entries[path] = (self.make_key(st), entries)
+
+    def flush(self):
+        if len(self.new_entries) == 0 and len(self.used) == 0:
+            return
+        now = int(time.time())
+        conn = self.connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO dir_listing (path, dev, ino, mtime_ns, ctime_ns, entries, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             [(path,) + key + (json.dumps(entries), now) for path, (key, entries) in self.new_entries.items()])
+            conn.executemany("UPDATE dir_listing SET last_used = ? WHERE path = ?", [(now, path) for path in self.used])
+        self.new_entries = dict()
+        self.used = set()
+
+    # drops listings older than max_age days, e.g. of removed directories
+    def evict(self):
+        self.flush()
+        if self.max_age is None:
+            return
+        conn = self.connect()
+        with conn:
+            cutoff = int(time.time() - self.max_age * 86400)
+            evicted = conn.execute("DELETE FROM dir_listing WHERE last_used < ?", (cutoff,)).rowcount
+        if evicted > 0:
+            self.logger.log(LogLevel.VERBOSE, f"evicted {evicted} listings from the listing cache at {self.cache_file}")
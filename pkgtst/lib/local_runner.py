@@ -0,0 +1,191 @@
+# local_runner.py
+
+# Runs package tests concurrently on the current host (the non-Slurm
+# counterpart to slurm_runner.py)
+
+import io
+import os
+import sys
+import yaml
+import time
+import datetime
+import threading
+import concurrent.futures
+
+from pkgtst.lib.logger import Logger
+from pkgtst.lib.logger import LogLevel
+from pkgtst.lib.fileint import FileInt
+from pkgtst.lib.fileint import PackedWrites
+from pkgtst.lib.utils import get_pkgtst_root
+
+# stands in for sys.stdout while packages are tested concurrently, what a test
+# thread writes goes to its own buffer if it has one (see capture()), so that
+# the output of each package can be printed as one block
+class ThreadOutput(io.TextIOBase):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    # the buffer of the calling thread, None stops capturing
+    def capture(self, buf):
+        self.local.buf = buf
+
+    def write(self, s):
+        buf = getattr(self.local, 'buf', None)
+        if buf is None:
+            return self.stream.write(s)
+        return buf.write(s)
+
+    def flush(self):
+        if getattr(self.local, 'buf', None) is None:
+            self.stream.flush()
+
+class LocalRunner:
+    def __init__(self, config_path=None, jobs=None):
+        self.logger = Logger(config_path=config_path)
+
+        if config_path:
+            self.config_path = config_path
+        else:
+            self.config_path = os.path.join(get_pkgtst_root(), 'etc', 'pkgtst.yaml')
+
+        if not os.path.exists(self.config_path):
+            self.logger.log(LogLevel.ERROR, f"Configuration file does not exist at {self.config_path}")
+
+        with open(self.config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+
+        # the number of packages tested at the same time
+        self.jobs = 1
+        local_config = self.config.get('local_runner') or {}
+        if local_config.get('jobs'):
+            self.jobs = int(local_config['jobs'])
+        if jobs is not None:
+            self.jobs = int(jobs)
+
+        if self.jobs < 1:
+            self.logger.log(LogLevel.ERROR, f"LocalRunner's jobs must be at least 1 (value: {self.jobs})")
+
+        self.lock = threading.Lock()
+
+    def format_duration(self, seconds):
+        return str(datetime.timedelta(seconds=int(seconds)))
+
+    # packages are ordered largest-first by their size in the fileint database,
+    # packages without a baseline are unknown and go first
+    def order_pkgs(self, pkgs, sizes):
+        return sorted(pkgs, key=lambda pkg: (pkg in sizes, -sizes.get(pkg, 0)))
+
+    def print_progress(self, package_id, results, done, total, done_bytes, total_bytes, start):
+        elapsed = time.monotonic() - start
+        if total_bytes > 0 and done_bytes > 0:
+            eta = elapsed * (total_bytes - done_bytes) / done_bytes
+        else:
+            eta = elapsed * (total - done) / done
+        if results is None:
+            status = 'ERROR'
+        elif results['passed_fileint'] and results['passed_lnfs']:
+            status = 'PASSED'
+        else:
+            status = 'FAILED'
+        try:
+            sys.stderr.write(f"[{done}/{total}] {package_id} -- {status} (elapsed: {self.format_duration(elapsed)}, ETA: {self.format_duration(eta)})\n")
+            sys.stderr.flush()
+        except BrokenPipeError:
+            pass
+
+    # test_func(package_id, fi) runs one package test with the given FileInt,
+    # every FileInt shares a single hashing pool, so [fileint][pool_size] is
+    # the cap on hashing workers no matter how many packages run at once
+    #
+    # the aliases of a package tree (e.g. python:3 and python:3.13.3) are
+    # tested one after another by the same job, sharing the rows of the tree
+    # so that it is only walked and hashed once
+    #
+    # a packed baseline is rewritten as a whole, so the packages the tests
+    # write to it are written at once when all of them are done
+    #
+    # with more than one job, what a test prints to stdout (e.g. its
+    # "FILEINT -- [PASSED]" lines) is held back until it completes and then
+    # printed at once, each line prefixed with the package id
+    def exec_all(self, pkgs, test_func):
+
+        if pkgs is None or not isinstance(pkgs, list):
+            self.logger.log(LogLevel.ERROR, 'the pkgs argument for LocalRunner::exec_all() must be a list')
+
+        fi = FileInt(config=self.config_path)
+        sizes = fi.get_package_sizes()
+        pkgs = self.order_pkgs(pkgs, sizes)
+
+        trees = fi.get_package_trees()
+        groups = dict()
+        for package_id in pkgs:
+            groups.setdefault(trees.get(package_id, package_id), []).append(package_id)
+
+        total = len(pkgs)
+        total_bytes = sum([sizes.get(pkg, 0) for pkg in pkgs])
+        progress = {'done': 0, 'done_bytes': 0}
+        start = time.monotonic()
+
+        self.logger.log(LogLevel.INFO, f"LocalRunner: testing {total} packages, {self.jobs} at a time")
+
+        pool = fi.open_pool()
+
+        packed_writes = None
+        if fi.dbformat == 'packed':
+            packed_writes = PackedWrites()
+
+        output = None
+        if self.jobs > 1:
+            output = ThreadOutput(sys.stdout)
+
+        def run(package_id, scanned_trees):
+            pkg_fi = FileInt(config=self.config_path)
+            pkg_fi.pool = pool
+            pkg_fi.scanned_trees = scanned_trees
+            pkg_fi.packed_writes = packed_writes
+            results = None
+            if output is not None:
+                buf = io.StringIO()
+                output.capture(buf)
+            try:
+                results = test_func(package_id, pkg_fi)
+            except BaseException as e:
+                # Logger.log() exits on errors, which must not end the other tests
+                self.logger.log(LogLevel.WARNING, f"test of {package_id} did not complete -- {e!r}")
+            finally:
+                if output is not None:
+                    output.capture(None)
+            with self.lock:
+                if output is not None:
+                    try:
+                        output.write("".join([f"{package_id}: {line}\n" for line in buf.getvalue().splitlines()]))
+                        output.flush()
+                    except BrokenPipeError:
+                        pass
+                progress['done'] += 1
+                progress['done_bytes'] += sizes.get(package_id, 0)
+                self.print_progress(package_id, results, progress['done'], total, progress['done_bytes'], total_bytes, start)
+            return results
+
+        def run_group(group):
+            scanned_trees = dict()
+            return [run(package_id, scanned_trees) for package_id in group]
+
+        stdout = sys.stdout
+        if output is not None:
+            sys.stdout = output
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                results = [results for group in executor.map(run_group, groups.values()) for results in group]
+        finally:
+            sys.stdout = stdout
+            fi.close_pool()
+            if packed_writes is not None:
+                packed_writes.write(fi)
+
+        failed = len([result for result in results if result is None or not (result['passed_fileint'] and result['passed_lnfs'])])
+        self.logger.log(LogLevel.INFO, f"LocalRunner: {total} packages tested, {failed} failed or did not complete, total time: {self.format_duration(time.monotonic() - start)}")
+
+        return results
@@ -0,0 +1,250 @@
+# packed_baseline - memory-mapped baseline of sorted fixed-width records
+
+# The pickle format has to unpickle the baselines of every package to check a
+# single one. A packed baseline is read through mmap instead, and only the
+# bytes of the package being checked are ever decoded:
+#
+#   header    magic, version, counts and the offsets of the sections below
+#   records   one fixed-width RECORD per file, grouped by package and sorted
+#             by relative_path within a package
+#   index     one fixed-width PACKAGE per package, sorted by package key (the
+#             hierarchy values joined with NUL) and base_path, holding the
+#             range of its records
+#   strings   the string table, records and index entries refer to strings
+#             by (offset, length)
+#
+# A package is found by binary search over the index, then its records are
+# unpacked from a single slice of the map.
+#
+# The file is never updated in place: a write builds a new file next to it and
+# renames it into place, readers that still have the old one mapped keep a
+# consistent view of it.
+
+import os
+import sys
+import mmap
+import struct
+
+from pkgtst.lib.file_table import FileRecord
+
+MAGIC = b'PKGTSTPK'
+VERSION = 1
+
+# magic, version, package count, record count, records offset, index offset,
+# strings offset, hierarchy names (offset, length)
+HEADER = struct.Struct('<8sIIQQQQQI')
+
+# key, base_path, hash_of_blob (as (offset, length) each), first record,
+# record count, flags
+PACKAGE = struct.Struct('<QIQIQIQQI')
+
+# relative_path, owner, content_hash, hash_algorithm, hash_tier,
+# segment_hashes (as (offset, length) each), the INT_COLUMNS, a bitmap of
+# the INT_COLUMNS that are null and flags
+RECORD = struct.Struct('<QIQIQIQIQIQIqqqQqqqqHH')
+
+STRING_COLUMNS = ['owner', 'content_hash', 'hash_algorithm', 'hash_tier', 'segment_hashes']
+INT_COLUMNS = ['mode', 'mod_time', 'file_size', 'inode', 'mtime_ns', 'ctime_ns', 'uid', 'gid']
+
+# the length of a null string
+NULL_LENGTH = 0xFFFFFFFF
+
+# package flags: hash_of_blob is the root of the directory digests
+MERKLE = 1
+
+# record flags: content_hash is stored as text rather than a binary digest
+TEXT_DIGEST = 1
+
+def encode(value):
+    return value.encode('utf-8', 'surrogateescape')
+
+def decode(value):
+    return value.decode('utf-8', 'surrogateescape')
+
+class StringTable:
+
+    def __init__(self):
+        self.data = bytearray()
+        # only short strings repeated across files (owner, algorithm, tier)
+        # are shared
+        self.shared = dict()
+
+    def add(self, value, shared=False):
+        if value is None:
+            return 0, NULL_LENGTH
+        if isinstance(value, str):
+            value = encode(value)
+        if shared and value in self.shared:
+            return self.shared[value]
+        ref = (len(self.data), len(value))
+        self.data += value
+        if shared:
+            self.shared[value] = ref
+        return ref
+
+# writes a packed baseline to path, packages is a list of (base_path,
+# fileint_row, flags) and rows(base_path) returns {relative_path: row} of a
+# package, it is only called for one package at a time
+def write_packed(path, hierarchy, packages, rows):
+    hierarchy = list(hierarchy or [])
+    strings = StringTable()
+
+    def key(package):
+        return encode("\0".join([str(package[1][component]) for component in hierarchy])), encode(package[0])
+    packages = sorted(packages, key=key)
+
+    tmp_path = path + '.tmp'
+    index = []
+    count = 0
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        for package in packages:
+            base_path, fileint_row, flags = package
+            package_rows = rows(base_path)
+            for relative_path in sorted(package_rows, key=encode):
+                row = package_rows[relative_path]
+                refs = [strings.add(relative_path)]
+                record_flags = 0
+                for column in STRING_COLUMNS:
+                    value = row[column]
+                    if column == 'content_hash' and value is not None:
+                        try:
+                            value = bytes.fromhex(value)
+                        except ValueError:
+                            record_flags |= TEXT_DIGEST
+                    refs.append(strings.add(value, shared=column in ('owner', 'hash_algorithm', 'hash_tier')))
+                nulls = 0
+                values = []
+                for i, column in enumerate(INT_COLUMNS):
+                    if row[column] is None:
+                        nulls |= 1 << i
+                        values.append(0)
+                    else:
+                        values.append(int(row[column]))
+                f.write(RECORD.pack(*[field for ref in refs for field in ref], *values, nulls, record_flags))
+            index.append(PACKAGE.pack(*strings.add(key(package)[0]), *strings.add(base_path), *strings.add(fileint_row.get('hash_of_blob')),
+                                      count, len(package_rows), flags))
+            count += len(package_rows)
+
+        index_offset = f.tell()
+        for entry in index:
+            f.write(entry)
+        strings_offset = f.tell()
+        hierarchy_ref = strings.add("\0".join(hierarchy))
+        f.write(strings.data)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), count, HEADER.size, index_offset, strings_offset, *hierarchy_ref))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class PackedBaseline:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            self.close()
+            raise Exception(f"ERROR: {path} is not a packed baseline (truncated header)")
+        (magic, version, self.package_count, self.record_count, self.records_offset, self.index_offset,
+         self.strings_offset, hierarchy_offset, hierarchy_length) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise Exception(f"ERROR: {path} is not a packed baseline of version {VERSION}")
+        hierarchy = self.string(hierarchy_offset, hierarchy_length)
+        self.hierarchy = hierarchy.split("\0") if hierarchy else []
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.package_count
+
+    def raw_string(self, offset, length):
+        if length == NULL_LENGTH:
+            return None
+        offset += self.strings_offset
+        return self.mm[offset:offset + length]
+
+    def string(self, offset, length):
+        value = self.raw_string(offset, length)
+        return None if value is None else decode(value)
+
+    def entry(self, i):
+        return PACKAGE.unpack_from(self.mm, self.index_offset + i * PACKAGE.size)
+
+    # the index entries whose hierarchy values match {component: value}, by
+    # binary search if all of them are given
+    def find(self, values=None):
+        values = values or {}
+        if any(component not in self.hierarchy for component in values):
+            return []
+        if len(values) < len(self.hierarchy):
+            found = []
+            for i in range(self.package_count):
+                components = self.components(self.entry(i))
+                if all(components[component] == value for component, value in values.items()):
+                    found.append(i)
+            return found
+
+        key = encode("\0".join([values[component] for component in self.hierarchy]))
+        lo, hi = 0, self.package_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw_string(*self.entry(mid)[0:2]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.package_count and self.raw_string(*self.entry(lo)[0:2]) == key:
+            found.append(lo)
+            lo += 1
+        return found
+
+    def components(self, entry):
+        key = self.string(*entry[0:2])
+        return dict(zip(self.hierarchy, key.split("\0") if self.hierarchy else []))
+
+    # (base_path, fileint_row, flags) of the package at index i
+    def package(self, i):
+        entry = self.entry(i)
+        fileint_row = self.components(entry)
+        fileint_row['hash_of_blob'] = self.string(*entry[4:6])
+        return self.string(*entry[2:4]), fileint_row, entry[8]
+
+    # {relative_path: FileRecord} of the package at index i, unpacked from the
+    # slice of the map holding its records
+    def rows(self, i):
+        entry = self.entry(i)
+        start = self.records_offset + entry[6] * RECORD.size
+        data = self.mm[start:start + entry[7] * RECORD.size]
+        # the strings shared by many records are decoded once
+        shared = dict()
+        rows = dict()
+        for fields in RECORD.iter_unpack(data):
+            record = FileRecord()
+            for j, column in enumerate(STRING_COLUMNS):
+                ref = fields[2 + 2 * j:4 + 2 * j]
+                if column == 'content_hash':
+                    value = self.raw_string(*ref)
+                    record.digest = decode(value) if value is not None and fields[-1] & TEXT_DIGEST else value
+                elif column == 'segment_hashes':
+                    record[column] = self.string(*ref)
+                else:
+                    if ref not in shared:
+                        value = self.string(*ref)
+                        shared[ref] = sys.intern(value) if value is not None else None
+                    setattr(record, column, shared[ref])
+            nulls = fields[-2]
+            for j, column in enumerate(INT_COLUMNS):
+                setattr(record, column, None if nulls & (1 << j) else fields[12 + j])
+            rows[self.string(*fields[0:2])] = record
+        return rows
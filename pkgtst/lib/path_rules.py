@@ -0,0 +1,119 @@
+# path_rules - include/exclude patterns for the files of a package
+
+# Rules are lists of patterns matched against the path of an entry relative to
+# the package directory (e.g. "lib/python3.13/__pycache__"):
+#
+#   __pycache__, *.pyc     a glob without a slash matches the name of an
+#                          entry at any depth
+#   share/doc, lib/**/test a glob with a slash is anchored at the package
+#                          directory, * and ? don't match a slash, ** matches
+#                          any number of directories
+#   re:.*/tests?/data      a regular expression, matching the whole path
+#
+# An excluded directory is not walked at all. When a package has include
+# rules, only the files (anything but directories) matching one of them are
+# kept, directories are still walked to find them. Exclude rules win over
+# include rules.
+#
+# Rules are global (fileint: include/exclude) or apply to the packages whose
+# package_id (e.g. "python:3.13.3") matches the glob of an entry in
+# fileint: package_rules. Each combination of rules is compiled to a single
+# regular expression per list once.
+
+import re
+import fnmatch
+
+def translate(pattern):
+    if pattern.startswith('re:'):
+        return pattern[3:]
+
+    anchored = '/' in pattern.strip('/')
+    pattern = pattern.strip('/')
+
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif c == '*':
+            regex += '[^/]*'
+            i += 1
+        elif c == '?':
+            regex += '[^/]'
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                regex += re.escape(c)
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                i = end + 1
+        else:
+            regex += re.escape(c)
+            i += 1
+
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return regex
+
+def compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join([f"(?:{translate(pattern)})" for pattern in patterns]))
+
+class PathRules:
+
+    def __init__(self, include=None, exclude=None):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+
+    def excluded(self, relative_path):
+        return self.exclude is not None and self.exclude.fullmatch(relative_path) is not None
+
+    # for entries that aren't directories
+    def included(self, relative_path):
+        return self.include is None or self.include.fullmatch(relative_path) is not None
+
+# the configured rules, compiled into a PathRules for each distinct set of
+# package_rules entries that apply to a package
+class PathRuleSet:
+
+    # package_rules: [{'package': glob, 'include': [...], 'exclude': [...]}]
+    def __init__(self, include=None, exclude=None, package_rules=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.package_rules = list(package_rules or [])
+        self.compiled = dict()
+        # raises re.error for invalid patterns up front
+        for i in range(len(self.package_rules)):
+            self.compile((i,))
+        self.compile(())
+
+    def compile(self, indices):
+        rules = self.compiled.get(indices)
+        if rules is None:
+            include = list(self.include)
+            exclude = list(self.exclude)
+            for i in indices:
+                include.extend(self.package_rules[i].get('include') or [])
+                exclude.extend(self.package_rules[i].get('exclude') or [])
+            rules = None
+            if include or exclude:
+                rules = PathRules(include, exclude)
+            self.compiled[indices] = rules
+        return rules
+
+    # returns the PathRules of the package with the given package_id, or None
+    # if there are none
+    def for_package(self, package_id):
+        indices = tuple([i for i, entry in enumerate(self.package_rules) if fnmatch.fnmatchcase(package_id, str(entry.get('package', '*')))])
+        return self.compile(indices)
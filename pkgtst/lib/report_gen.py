@@ -9,6 +9,9 @@ import fcntl
 import yaml
 import sys
 import shutil
+import json
+import socket
+import tempfile
 
 from pkgtst.lib.logger import Logger
 from pkgtst.lib.logger import LogLevel
@@ -24,6 +27,7 @@ class ReportGen():
 
         self.dbfile = os.path.join(get_pkgtst_root(), 'var', 'db', 'results.sql')
         self.rendered_html = os.path.join(get_pkgtst_root(), 'var', 'html', 'test_results.html')
+        self.spool_dir = None
 
         if config_path is None:
             self.config_path = os.path.join(get_pkgtst_root(), 'etc', 'pkgtst.yaml')
@@ -47,6 +51,10 @@ class ReportGen():
                     self.ct_warn_only = []
                 if self.config['report_gen']['retention']:
                     self.retention = self.config['report_gen']['retention']
+                # with a spool_dir, tests write their results to files there
+                # instead of the database, see ingest_spool()
+                if self.config['report_gen'].get('spool_dir'):
+                    self.spool_dir = self.config['report_gen']['spool_dir']
                 if self.config['report_gen']['output_limit_per']:
                     # the output limit per package
                     self.output_limit_per = self.config['report_gen']['output_limit_per']
@@ -76,7 +84,13 @@ class ReportGen():
         self.logger = Logger(config_path=self.config_path)
 
     def create_db(self):
-        conn = sqlite3.connect(self.dbfile)
+        # the database is built under a temporary name and then moved into
+        # place, so that a concurrent write_result() never sees it without tables
+        tmp_dbfile = self.dbfile + '.tmp'
+        if os.path.exists(tmp_dbfile):
+            os.remove(tmp_dbfile)
+
+        conn = sqlite3.connect(tmp_dbfile)
         cursor = conn.cursor()
 
         query = '''
@@ -98,6 +112,8 @@ CREATE TABLE IF NOT EXISTS results (
         cursor.close()
         conn.close()
 
+        os.replace(tmp_dbfile, self.dbfile)
+
         self.logger.log(LogLevel.INFO, f"created database at {self.dbfile}")
 
     def create_db_with_lock(self):
@@ -116,15 +132,18 @@ CREATE TABLE IF NOT EXISTS results (
                 # Release the lock
                 fcntl.flock(f, fcntl.LOCK_UN)
 
-    def trim_results(self, package_id):
-        self.logger.log(LogLevel.INFO, f"INFO: self.retention: {self.retention}")
-        
-        if len(package_id) != len(self.hierarchy.components):
-            # retention rules only apply to individual packages
-            return
+    # the (query, values) that apply the retention rules to the results of
+    # the given packages (lists of hierarchy values), date based rules are
+    # the same for every package and only returned once
+    def retention_queries(self, package_ids):
+
+        # retention rules only apply to individual packages
+        package_ids = [package_id for package_id in package_ids if len(package_id) == len(self.hierarchy.components)]
+        if len(package_ids) == 0:
+            return []
 
         if self.retention is None:
-            return
+            return []
 
         n, units = self.retention.split(" ")
 
@@ -136,9 +155,6 @@ CREATE TABLE IF NOT EXISTS results (
         if units not in {'runs', 'days', 'weeks', 'months', 'years'}:
             raise Exception(f"ERROR: invalid units in retention value (value: {self.retention}, should read as '<n> <units>')")
 
-        conn = sqlite3.connect(self.dbfile)
-        cursor = conn.cursor()
-
         if units == 'runs':
             query = """
 DELETE FROM results WHERE ROWID IN (
@@ -148,7 +164,7 @@ DELETE FROM results WHERE ROWID IN (
     ORDER BY datetime ASC
     LIMIT -1 OFFSET %s
 );""" % (" AND ".join([f"{component} = ?" for component in self.hierarchy.components]), n)
-            values = package_id
+            return [(query, list(package_id)) for package_id in package_ids]
         else:
             if units == 'days':
                 scalar = 1
@@ -163,12 +179,22 @@ DELETE FROM results WHERE ROWID IN (
             timestamp = mydate.strftime('%Y-%m-%d 00:00:00')
             self.logger.log(LogLevel.TRACE, f"days = {days}, timestamp = '{timestamp}'")
             query = "DELETE FROM results WHERE datetime < ?"
-            values = [timestamp]
             self.logger.log(LogLevel.TRACE, f"query = {query}")
+            return [(query, [timestamp])]
 
-        self.logger.log(LogLevel.TRACE, f"query: '{query}', values: '{values}'")
+    def trim_results(self, package_id):
+        self.logger.log(LogLevel.INFO, f"INFO: self.retention: {self.retention}")
 
-        cursor.execute(query, values)
+        queries = self.retention_queries([package_id])
+        if len(queries) == 0:
+            return
+
+        conn = sqlite3.connect(self.dbfile)
+        cursor = conn.cursor()
+
+        for query, values in queries:
+            self.logger.log(LogLevel.TRACE, f"query: '{query}', values: '{values}'")
+            cursor.execute(query, values)
 
         self.logger.log(LogLevel.INFO, 'The results database may have been changed (operation: trim), consider updating the results page (i.e. by executing pkgtst report --render-jinja')
 
@@ -182,6 +208,10 @@ DELETE FROM results WHERE ROWID IN (
         if not isinstance(package_id, list):
             raise Exception(f"ERROR: in report_gen::write_result package_id must be a list")
 
+        if self.spool_dir is not None:
+            self.spool_result(package_id, pkg_base, module_name, results)
+            return
+
         if not os.path.exists(self.dbfile):
             self.create_db_with_lock()
 
@@ -207,6 +237,116 @@ VALUES (%s)''' % (self.column_string, ", ".join("?" * len(values)))
 
         self.trim_results(package_id)
 
+    # writes a result to a new file in spool_dir, it is written under a hidden
+    # name and then renamed, so ingest_spool() only ever sees complete files
+    def spool_result(self, package_id, pkg_base, module_name, results):
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        row = {
+            'datetime': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'package_id': dict(zip(self.hierarchy.components, package_id)),
+            'package_base': pkg_base,
+            'module_name': module_name,
+            'passed_fileint': bool(results['passed_fileint']),
+            'passed_lnfs': bool(results['passed_lnfs']),
+        }
+
+        prefix = f"result_{datetime.datetime.now().strftime('%Y%m%dT%H%M%S')}_{socket.gethostname()}_{os.getpid()}_"
+        fd, tmp_file = tempfile.mkstemp(prefix='.' + prefix, suffix='.jsonl', dir=self.spool_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        spool_file = os.path.join(self.spool_dir, os.path.basename(tmp_file)[1:])
+        os.rename(tmp_file, spool_file)
+
+        self.logger.log(LogLevel.INFO, f"The result has been spooled to {spool_file}, it is added to the results database by the next pkgtst report")
+
+    # moves the spooled results into the database in one transaction and
+    # applies the retention rules once for the packages they belong to. The
+    # names of the ingested files are recorded in the same transaction, so a
+    # file that could not be removed afterwards is not ingested twice.
+    # Overlapping runs are serialized by a lock file in spool_dir, which is
+    # held from listing the spool until its files are removed.
+    def ingest_spool(self):
+
+        if self.spool_dir is None or not os.path.isdir(self.spool_dir):
+            return 0
+
+        if not any([name.endswith('.jsonl') and not name.startswith('.') for name in os.listdir(self.spool_dir)]):
+            return 0
+
+        if not os.path.exists(self.dbfile):
+            self.create_db_with_lock()
+
+        with open(os.path.join(self.spool_dir, '.ingest.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                return self.ingest_spool_files()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # the part of ingest_spool() that runs under its lock
+    def ingest_spool_files(self):
+
+        spool_files = sorted([name for name in os.listdir(self.spool_dir) if name.endswith('.jsonl') and not name.startswith('.')])
+        if len(spool_files) == 0:
+            return 0
+
+        conn = sqlite3.connect(self.dbfile)
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS spool_ingested (name TEXT NOT NULL PRIMARY KEY)")
+        ingested = set([row[0] for row in cursor.execute("SELECT name FROM spool_ingested").fetchall()])
+
+        rows = []
+        names = []
+        for name in spool_files:
+            if name in ingested:
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name), 'r') as f:
+                    for line in f:
+                        if len(line.strip()) == 0:
+                            continue
+                        row = json.loads(line)
+                        rows.append([row['datetime']] + [row['package_id'][component] for component in self.hierarchy.components] +
+                                    [row['package_base'], row['module_name'], row['passed_fileint'], row['passed_lnfs']])
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.log(LogLevel.WARNING, f"skipping the spooled result {name} -- {e}")
+                continue
+            names.append(name)
+
+        query = '''INSERT INTO results (datetime, %s, package_base, module_name, passed_fileint, passed_lnfs)
+VALUES (%s)''' % (self.column_string, ", ".join("?" * (len(self.hierarchy.components) + 5)))
+
+        package_ids = sorted(set([tuple(row[1:1 + len(self.hierarchy.components)]) for row in rows]))
+
+        with conn:
+            cursor.executemany(query, rows)
+            cursor.executemany("INSERT OR IGNORE INTO spool_ingested (name) VALUES (?)", [(name,) for name in names])
+            for query, values in self.retention_queries(package_ids):
+                cursor.execute(query, values)
+
+        removed = []
+        for name in set(names) | ingested:
+            try:
+                os.remove(os.path.join(self.spool_dir, name))
+                removed.append(name)
+            except FileNotFoundError:
+                removed.append(name)
+            except OSError as e:
+                self.logger.log(LogLevel.WARNING, f"could not remove the spooled result {name} -- {e}")
+        with conn:
+            cursor.executemany("DELETE FROM spool_ingested WHERE name = ?", [(name,) for name in removed])
+
+        cursor.close()
+        conn.close()
+
+        self.logger.log(LogLevel.INFO, f"Ingested {len(rows)} spooled results from {self.spool_dir}")
+
+        return len(rows)
+
     def create_ct_tbl(self):
         conn = sqlite3.connect(self.dbfile)
         cursor = conn.cursor()
@@ -323,6 +463,9 @@ DELETE FROM ct_results WHERE ROWID IN (
         if not isinstance(package_id, list):
             raise Exception(f"ERROR: in report_gen::delete_package package_id must be a list")
 
+        # or the spooled results of the package would come back
+        self.ingest_spool()
+
         if not os.path.exists(self.dbfile):
             self.create_db_with_lock()
 
@@ -563,6 +706,8 @@ DELETE FROM ct_results WHERE ROWID IN (
         if limit_per is None and self.output_limit_per is not None:
             limit_per = self.output_limit_per
 
+        self.ingest_spool()
+
         if os.path.exists(self.dbfile):
             conn = sqlite3.connect(self.dbfile)
             conn.row_factory = sqlite3.Row
@@ -11,10 +11,14 @@ import datetime
 import glob
 import shlex
 import pprint
+import tempfile
 
 from pkgtst.lib.logger import Logger
 from pkgtst.lib.logger import LogLevel
 from pkgtst.lib.utils import get_pkgtst_root
+from pkgtst.lib.fileint import FileInt
+
+MANIFEST_COLUMNS = ['task_id', 'package_id', 'base_path', 'module_name']
 
 class SlurmRunner:
     def __init__(self, config_path=None):
@@ -113,33 +117,108 @@ class SlurmRunner:
                 seen_pkgs |= set(row['package_ids'])
 
             pkgs = [pkg for pkg in pkgs if pkg not in seen_pkgs]
-            self.exec_array(pkgs, script_args=['--filter-no-constraint'])
+            self.exec_array(pkgs)
 
             for constraint in constraints:
-                self.exec_array(constraints[constraint], sbatch_args=[f"--constraint={constraint}"], script_args=[f"--filter-constraint={constraint}"])
+                self.exec_array(constraints[constraint], sbatch_args=[f"--constraint={constraint}"])
                     
         else:
             self.exec_array(pkgs)
         
 
-    def exec_array(self, pkgs, sbatch_args=[], script_args=[]):
+    # the module names listed by "module -t avail", None if they could not
+    # be listed
+    def available_modules(self):
+        stdout, stderr, exit_code = self.run_cmd("module -t avail 2>&1")
+        if exit_code != 0:
+            return None
+        modules = set()
+        for line in stdout.splitlines():
+            line = line.strip()
+            # the module path headers end with a colon
+            if len(line) == 0 or line.endswith(':'):
+                continue
+            line = re.sub(r'\((default|D)\)$', '', line).rstrip('/')
+            modules.add(line)
+        if len(modules) == 0:
+            return None
+        return modules
+
+    # writes the package_id, base_path and module_name of each array task to
+    # a new read-only TSV file under output_dir/arrays, so that a task tests
+    # the package it was submitted for even if the packages change in the
+    # meantime, without discovering them again. A module_name is only
+    # recorded if the module exists, tasks look the others up themselves.
+    def write_manifest(self, pkgs):
+
+        fi = FileInt(config=self.config_path)
+        # refreshed by the enumeration that produced pkgs
+        base_paths = fi.get_base_paths(refresh=False)
+        modules = self.available_modules()
+
+        rows = []
+        for package_id in pkgs:
+            if package_id not in base_paths:
+                self.logger.log(LogLevel.WARNING, f"package {package_id} was not found, it is left out of the job array")
+                continue
+            module_name = package_id.replace(':', '/')
+            if modules is None or module_name not in modules:
+                module_name = ''
+            row = [str(len(rows) + 1), package_id, base_paths[package_id], module_name]
+            if any(['\t' in value or '\n' in value for value in row]):
+                self.logger.log(LogLevel.WARNING, f"package {package_id} can't be written to a job manifest (tab or newline in its base_path), it is left out of the job array")
+                continue
+            rows.append(row)
 
-        self.logger.log(LogLevel.VERBOSE, f"in SlurmRunner::exec_array() -- #pkgs: {len(pkgs)}, sbatch_args: {sbatch_args}, script_args={script_args}")
+        manifest_dir = os.path.join(self.output_dir, 'arrays')
+        os.makedirs(manifest_dir, exist_ok=True)
+        date_str = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        fd, manifest_file = tempfile.mkstemp(prefix=f"pkgtst_manifest_{date_str}_", suffix='.tsv', dir=manifest_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write('\t'.join(MANIFEST_COLUMNS) + '\n')
+            for row in rows:
+                f.write('\t'.join(row) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(manifest_file, 0o444)
+
+        self.logger.log(LogLevel.INFO, f"wrote the job manifest {manifest_file} ({len(rows)} packages)")
+
+        return manifest_file, len(rows)
+
+    # returns {column: value} for the task task_id of a job manifest
+    def read_manifest(self, manifest_file, task_id):
+        with open(manifest_file, 'r') as f:
+            header = f.readline().rstrip('\n').split('\t')
+            if header != MANIFEST_COLUMNS:
+                self.logger.log(LogLevel.ERROR, f"{manifest_file} is not a job manifest")
+            # task ids are line numbers, counting from 1 after the header
+            for line in f:
+                row = line.rstrip('\n').split('\t')
+                if row[0] == str(task_id):
+                    return dict(zip(MANIFEST_COLUMNS, row))
+        self.logger.log(LogLevel.ERROR, f"task {task_id} not found in the job manifest {manifest_file}")
+
+    def exec_array(self, pkgs, sbatch_args=[]):
+
+        self.logger.log(LogLevel.VERBOSE, f"in SlurmRunner::exec_array() -- #pkgs: {len(pkgs)}, sbatch_args: {sbatch_args}")
 
         if pkgs is None or not isinstance(pkgs, list):
             self.logger.log(LogLevel.ERROR, 'the pkgs argument for SlurmRunner::exec_all() must be a list in order to test packages')
 
         DIRNAME = get_pkgtst_root()
-        N = len(pkgs)
+        manifest_file, N = self.write_manifest(pkgs)
+        if N == 0:
+            self.logger.log(LogLevel.INFO, f"no packages to test, the job array is not submitted")
+            return
         output_file = os.path.join(self.output_dir, 'arrays', 'pkgtst_combined_%A.log')
 
         array_arg = f"1-{N}%{int(self.array_task_throttle)}"
         job_script = os.path.join(DIRNAME, 'etc', 'pkgtst_array.sh')
 
         sbatch_args = [shlex.quote(sbatch_arg) for sbatch_arg in sbatch_args]
-        script_args = [shlex.quote(script_arg) for script_arg in script_args]
         
-        cmd = f"sbatch {' '.join(sbatch_args)} --array={shlex.quote(array_arg)} --output={shlex.quote(output_file)} {shlex.quote(job_script)} {' '.join(script_args)} | awk '{{ print $4 }}'"
+        cmd = f"sbatch {' '.join(sbatch_args)} --array={shlex.quote(array_arg)} --output={shlex.quote(output_file)} {shlex.quote(job_script)} {shlex.quote(manifest_file)} | awk '{{ print $4 }}'"
         stdout, stderr, exit_code = self.run_cmd(cmd)
         try:
             jobid = int(stdout.strip())
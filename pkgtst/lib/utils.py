@@ -3,6 +3,9 @@
 # For common utility functions across multiple scripts
 
 import os
+import pwd
+import grp
+import functools
 
 def get_pkgtst_root():
 
@@ -17,3 +20,23 @@ def get_pkgtst_root():
         from pkgtst.lib.logger import Logger
         logger = Logger(skip_config_parse=True)
         logger.log(LogLevel.ERROR, f"PKGTST_ROOT is not set to a valid directory (value: {root})")
+
+# uid/gid -> name lookups go through NSS (possibly SSSD/LDAP), so they are
+# cached for the life of the process
+ID_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=ID_CACHE_SIZE)
+def uid_to_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        # unknown ids are reported numerically
+        return str(uid)
+
+@functools.lru_cache(maxsize=ID_CACHE_SIZE)
+def gid_to_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        # unknown ids are reported numerically
+        return str(gid)
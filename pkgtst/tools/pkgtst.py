@@ -6,6 +6,7 @@ from pkgtst.lib.logger import Logger
 from pkgtst.lib.logger import LogLevel
 from pkgtst.lib.custom_test import CustomTest
 from pkgtst.lib.slurm_runner import SlurmRunner
+from pkgtst.lib.local_runner import LocalRunner
 from pkgtst.lib.utils import get_pkgtst_root
 from pkgtst.lib.config import ConfigUtil
 
@@ -45,7 +46,12 @@ def get_filters(package_id_string, config_path=None):
 
     return filters
 
-def do_test(package_id_string, do_reset=False, config_path=None):
+# fi may be an existing FileInt, e.g. one holding a pool from open_pool()
+#
+# base_path and module_name skip the discovery of the package and the lookup
+# of its module when they are already known (e.g. from a Slurm job manifest),
+# a module_name of None is looked up
+def do_test(package_id_string, do_reset=False, config_path=None, full_verify=False, fi=None, base_path=None, module_name=None):
 
     filters = get_filters(package_id_string, config_path)
 
@@ -60,8 +66,12 @@ def do_test(package_id_string, do_reset=False, config_path=None):
         ignore_paths = None
 
     # 1. check the file integrity
-    fi = FileInt(config=config_path)
-    fi_results = fi.read_paths(filters, do_reset)
+    if fi is None:
+        fi = FileInt(config=config_path)
+    if base_path is not None:
+        fi_results = fi.read_paths(filters, do_reset, full_verify, base_paths=[base_path])
+    else:
+        fi_results = fi.read_paths(filters, do_reset, full_verify)
 
     logger = Logger(config_path=config_path)
     logger.log(LogLevel.INFO, f"PROCESSING PACKAGE: {package_id_string}")
@@ -72,9 +82,12 @@ def do_test(package_id_string, do_reset=False, config_path=None):
     # we'll assume a module name to be "{component1}/{component2}/..."
     h = Hierarchy(config_path=config_path)
     lmod_arg = shlex.quote(package_id_string.replace(":", "/"))
-    stdout = get_command_output(f"module display {lmod_arg} &> /dev/null && echo -n exists")
-    if len(stdout) > 0 and stdout == "exists":
-        module_name = lmod_arg
+    if module_name is None:
+        stdout = get_command_output(f"module display {lmod_arg} &> /dev/null && echo -n exists")
+        if len(stdout) > 0 and stdout == "exists":
+            module_name = package_id_string.replace(":", "/")
+    if module_name:
+        module_name = shlex.quote(module_name)
         stdout = get_command_output(f"module load {module_name} &> /dev/null && printenv LD_LIBRARY_PATH 2> /dev/null")
         if len(stdout) > 0:
             ld_lib_path = stdout
@@ -86,7 +99,10 @@ def do_test(package_id_string, do_reset=False, config_path=None):
 
     # 3. run lnfs against the root dir of the package
     mlc = MissingLibScanner(config=config_path)
-    pkg_base_paths = fi.get_filter_matches(filters)
+    if base_path is not None:
+        pkg_base_paths = [base_path]
+    else:
+        pkg_base_paths = fi.get_filter_matches(filters)
     if len(pkg_base_paths) == 0:
         logger.log(LogLevel.ERROR, f'pkg_base_path resolution failed for package_id {package_id_string}, use "pkgtst enumerate" to list valid package_ids')
     elif len(pkg_base_paths) > 1:
@@ -108,7 +124,10 @@ def do_test(package_id_string, do_reset=False, config_path=None):
         print("LIBSCAN -- [FAILED]")
 
     x = ReportGen(config_path=config_path)
-    x.write_result([row['value'] for row in filters], pkg_base_paths[0], module_name, {'passed_fileint': passed_fileint, 'passed_lnfs': passed_lnfs})
+    results = {'passed_fileint': passed_fileint, 'passed_lnfs': passed_lnfs}
+    x.write_result([row['value'] for row in filters], pkg_base_paths[0], module_name, results)
+
+    return results
 
 def main():
 
@@ -122,6 +141,10 @@ def main():
     parser_test.add_argument('package_id', nargs='?', type=str, help='Identifier of package to test, separate hierarchy components with a colon')
     parser_test.add_argument('-a', '--all', action='store_true', help='Set this argument to test all packages')
     parser_test.add_argument('-s', '--slurm', action='store_true', help='Set this argument to run package test(s) in a Slurm job')
+    parser_test.add_argument('-j', '--jobs', type=int, help='With -a/--all and without -s/--slurm, the number of packages to test at the same time (overrides [local_runner][jobs])')
+    parser_test.add_argument('-F', '--full-verify', action='store_true', help='Re-hash the content of every file, even if [fileint][fast_verify] is set')
+    parser_test.add_argument('--manifest', type=str, help='Test the package of --task-id in this Slurm job manifest (used by Slurm array tasks)')
+    parser_test.add_argument('--task-id', type=int, help='Only used if --manifest is specified, the task id of the package to test')
 
     # Create a subparser for the 'print' command
     parser_print = subparsers.add_parser('report', help='Report test results')
@@ -156,6 +179,26 @@ def main():
     # Create a subparser for the 'reset' command
     parser_reset = subparsers.add_parser('reset', help='Reset a specific version of a package')
     parser_reset.add_argument('package_id', type=str, help='Identifier of package to reset, separate hierarchy components with a colon')
+    parser_reset.add_argument('-F', '--full-verify', action='store_true', help='Re-hash the content of every file, even if [fileint][fast_verify] is set')
+
+    # Create subparsers for the baseline history commands
+    parser_history = subparsers.add_parser('history', help='List the baseline generations kept for a package')
+    parser_history.add_argument('package_id', type=str, help='Identifier of package, separate hierarchy components with a colon')
+
+    parser_rollback = subparsers.add_parser('rollback', help='Make an earlier baseline generation of a package its current baseline')
+    parser_rollback.add_argument('package_id', type=str, help='Identifier of package to roll back, separate hierarchy components with a colon')
+    parser_rollback.add_argument('-g', '--generation', type=int, help='Generation to roll back to (see the history command), default is the one before the current')
+
+    parser_diff = subparsers.add_parser('diff', help='Print the differences between two baseline generations of a package')
+    parser_diff.add_argument('package_id', type=str, help='Identifier of package, separate hierarchy components with a colon')
+    parser_diff.add_argument('generation_a', type=int, help='Generation to compare')
+    parser_diff.add_argument('generation_b', type=int, nargs='?', help='Generation to compare with, default is the current one')
+
+    # Create a subparser for the 'convert' command
+    parser_convert = subparsers.add_parser('convert', help='Convert a baseline between the sqlite3 and packed formats')
+    parser_convert.add_argument('-t', '--to', choices=['packed', 'sqlite3'], required=True, help='Format to convert to')
+    parser_convert.add_argument('source', nargs='+', type=str, help='Baseline to convert (to packed, several sqlite3 databases such as the shards under [fileint][shard_dir] are combined into one)')
+    parser_convert.add_argument('destination', type=str, help='File to write the converted baseline to')
 
     # Create a subparser for the 'custom_test' command
     parser_custom_test = subparsers.add_parser('custom_test', help='Reset a specific version of a package')
@@ -237,7 +280,11 @@ def main():
             fi = FileInt(config=args.config_path)
             h = Hierarchy(config_path=args.config_path)
 
-            pkgs = fi.get_hierarchy(ignore_paths)
+            if args.command == 'test' and args.manifest:
+                # the manifest already names the package and its base_path
+                pkgs = None
+            else:
+                pkgs = fi.get_hierarchy(ignore_paths)
 
         if args.command == 'enumerate':
 
@@ -283,12 +330,20 @@ def main():
             # 3. one + no_slurm
             # 4. one + slurm
 
-            if args.all:
+            if args.manifest:
+
+                if args.task_id is None:
+                    logger.log(LogLevel.ERROR, f"--manifest requires --task-id")
+                runner = SlurmRunner(config_path=args.config_path)
+                entry = runner.read_manifest(args.manifest, args.task_id)
+                do_test(entry['package_id'], False, args.config_path, args.full_verify, fi, entry['base_path'], entry['module_name'] or None)
+
+            elif args.all:
 
                 if not args.slurm:
-                    for row in pkgs:
-                        package_id = ':'.join([row[component] for component in h.components])
-                        do_test(package_id, False, args.config_path)
+                    runner = LocalRunner(config_path=args.config_path, jobs=args.jobs)
+                    pkgs = [ ':'.join([row[component] for component in h.components]) for row in pkgs ]
+                    runner.exec_all(pkgs, lambda package_id, pkg_fi: do_test(package_id, False, args.config_path, args.full_verify, pkg_fi))
                 elif args.slurm:
                     runner = SlurmRunner(config_path=args.config_path)
                     pkgs = [ ':'.join([row[component] for component in h.components]) for row in pkgs ]
@@ -301,7 +356,7 @@ def main():
                     return
                 
                 if not args.slurm:
-                    do_test(args.package_id, False, args.config_path)
+                    do_test(args.package_id, False, args.config_path, args.full_verify)
                 else:
                     runner = SlurmRunner(config_path=args.config_path)
                     runner.exec_one(args.package_id)
@@ -319,7 +374,38 @@ def main():
         reporter.delete_package(args.package_id.split(":"))
         return 0
     elif args.command == 'reset':
-        do_test(args.package_id, True, args.config_path)
+        do_test(args.package_id, True, args.config_path, args.full_verify)
+        return 0
+    elif args.command == 'history':
+        fi = FileInt(config=args.config_path)
+        for base_path, generations in fi.history(get_filters(args.package_id, args.config_path)).items():
+            print(base_path)
+            for generation, created, hash_of_blob, changed in generations:
+                current = ' (current)' if generation == generations[-1][0] else f', {changed} files changed by the next'
+                print(f"  {generation}: {created or 'before the history'}, {hash_of_blob}{current}")
+        return 0
+    elif args.command == 'rollback':
+        fi = FileInt(config=args.config_path)
+        fi.rollback(get_filters(args.package_id, args.config_path), args.generation)
+        return 0
+    elif args.command == 'diff':
+        fi = FileInt(config=args.config_path)
+        for base_path, diffs in fi.diff_generations(get_filters(args.package_id, args.config_path), args.generation_a, args.generation_b).items():
+            print(f"{base_path}: {len(diffs)} differences")
+            for diff in diffs:
+                if diff['column'] is None:
+                    print(f"  {diff['mismatch_type'].name} {diff['row'][1] if isinstance(diff['row'], tuple) else diff['row']}")
+                else:
+                    print(f"  {diff['mismatch_type'].name} {diff['row'][1] if isinstance(diff['row'], tuple) else diff['row']} {diff['column']}: {diff['A'][diff['column']]} -> {diff['B'][diff['column']]}")
+        return 0
+    elif args.command == 'convert':
+        fi = FileInt(config=args.config_path)
+        if args.to == 'packed':
+            fi.sqlite_to_packed(args.source, args.destination)
+        elif len(args.source) > 1:
+            raise Exception(f"ERROR: only a single packed baseline can be converted to sqlite3 (got {len(args.source)})")
+        else:
+            fi.packed_to_sqlite(args.source[0], args.destination)
         return 0
     elif args.command == 'custom_test':
         ct = CustomTest(config_path=args.config_path)
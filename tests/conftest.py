@@ -0,0 +1,90 @@
+# conftest - a PKGTST_ROOT sandbox with a small package tree for the tests
+
+import os
+import yaml
+import pytest
+
+from pkgtst.lib.fileint import FileInt
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# files of the sandbox's package tree, relative to its packages directory
+PACKAGE_FILES = {
+    'python/3.13.3/bin/python': b'hello\n',
+    'python/3.13.3/lib/big.bin': bytes(range(256)) * 1200,
+    'python/3.13.3/lib/sub/a.txt': b'x\n',
+    'r/4.4.1/lib/r.so': b'r\n',
+    'tool/1.0/t': b't\n',
+}
+
+class Sandbox:
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.packages = os.path.join(self.root, 'packages')
+        self.config_path = os.path.join(self.root, 'etc', 'pkgtst.yaml')
+        for directory in ('etc', 'var/db', 'var/log', 'packages'):
+            os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+        for relative_path, content in PACKAGE_FILES.items():
+            self.write(relative_path, content)
+        os.symlink('lib', os.path.join(self.packages, 'python/3.13.3/lib64'))
+        # an alias of python:3.13.3
+        os.symlink('3.13.3', os.path.join(self.packages, 'python/3'))
+
+        # the shipped configuration, pointed at the sandbox
+        with open(os.path.join(REPO_ROOT, 'etc', 'pkgtst.yaml'), 'r') as f:
+            self.config = yaml.safe_load(f)
+        self.config['general']['base'] = [self.packages]
+        self.config['general']['path_limit'] = self.packages
+        self.config['fileint']['dbfile'] = os.path.join(self.root, 'var', 'db', 'fileint.sql')
+        self.config['fileint']['pool_type'] = 'thread'
+        self.config['fileint']['pool_size'] = 2
+        self.config['report_gen']['dbfile'] = os.path.join(self.root, 'var', 'db', 'results.sql')
+        self.config['report_gen']['rendered_html'] = os.path.join(self.root, 'results.html')
+        self.config['slurm_runner']['output_dir'] = os.path.join(self.root, 'var', 'log')
+        self.configure()
+
+    # updates [fileint] with the given values and writes the config file
+    def configure(self, **fileint):
+        self.config['fileint'].update(fileint)
+        with open(self.config_path, 'w') as f:
+            yaml.safe_dump(self.config, f)
+
+    def path(self, relative_path):
+        return os.path.join(self.packages, relative_path)
+
+    def write(self, relative_path, content):
+        path = self.path(relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def fileint(self):
+        return FileInt(config=self.config_path)
+
+    def filters(self, package_id):
+        hierarchy = self.config['fileint']['hierarchy']
+        return [{'hierarchy': component, 'value': value} for component, value in zip(hierarchy, package_id.split(':'))]
+
+    # tests (or with accept, resets) a package like "pkgtst test", returns the
+    # results of read_paths()
+    def test(self, package_id, accept=False, full_verify=False, fi=None):
+        if fi is None:
+            fi = self.fileint()
+        return fi.read_paths(self.filters(package_id), accept, full_verify)
+
+    # the results of read_paths() show no difference from the baseline
+    @staticmethod
+    def passed(results):
+        return not results[2] and not results[3]
+
+    # the file diffs of read_paths() results as (relative_path, column)
+    @staticmethod
+    def file_diffs(results):
+        return sorted([(diff['row'][1], diff['column']) for diff in results[3] or []], key=str)
+
+@pytest.fixture
+def sandbox(tmp_path, monkeypatch):
+    monkeypatch.setenv('PKGTST_ROOT', str(tmp_path))
+    monkeypatch.delenv('PKGTST_CONFIG_PATH', raising=False)
+    return Sandbox(tmp_path)
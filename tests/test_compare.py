@@ -0,0 +1,50 @@
+# stream_compare (the merge join over an sqlite3 baseline) gives the same
+# diffs as tbl_compare over the baseline loaded into memory
+
+import os
+
+PACKAGE = 'python:3.13.3'
+
+def change_package(sandbox):
+    sandbox.write('python/3.13.3/lib/sub/a.txt', b'changed\n')
+    sandbox.write('python/3.13.3/lib/sub/b.txt', b'new\n')
+    sandbox.write('python/3.13.3/aaa', b'sorts first\n')
+    os.remove(sandbox.path('python/3.13.3/bin/python'))
+    os.chmod(sandbox.path('python/3.13.3/lib/big.bin'), 0o600)
+
+def normalized(diffs):
+    return sorted([(diff['row'], diff['mismatch_type'].name, diff['column']) for diff in diffs], key=str)
+
+def test_stream_compare_matches_tbl_compare(sandbox):
+    sandbox.test(PACKAGE)
+    change_package(sandbox)
+
+    fi = sandbox.fileint()
+    filters = sandbox.filters(PACKAGE)
+    prev_fileint_tbl, prev_file_tbl = fi.read_saved_tbls(filters)
+    fileint_tbl, file_tbl, fileint_tbl_diffs, file_tbl_diffs = fi.read_paths(filters)
+    base_path = sandbox.path('python/3.13.3')
+
+    expected = normalized(fi.tbl_compare(prev_file_tbl, file_tbl))
+    assert ((base_path, 'bin/python'), 'MISSING_ROW', None) in expected
+    assert ((base_path, 'aaa'), 'EXTRA_ROW', None) in expected
+    assert ((base_path, 'lib/big.bin'), 'WRONG_VALUE', 'mode') in expected
+
+    rows = sorted(file_tbl.package(base_path).items())
+    assert normalized(fi.stream_compare(base_path, rows)) == expected
+
+    # limited to the directories whose digest changed
+    dirs = fi.changed_dirs(base_path, fi.merkle_digests(file_tbl.package(base_path)))
+    rows = [(relative_path, row) for relative_path, row in rows if relative_path[:relative_path.rfind('/') + 1] in dirs]
+    assert normalized(fi.stream_compare(base_path, rows, dirs=dirs)) == expected
+
+    # and read_paths() reports them
+    assert normalized(file_tbl_diffs) == expected
+
+def test_stream_compare_empty_package(sandbox):
+    sandbox.test(PACKAGE)
+    fi = sandbox.fileint()
+    base_path = sandbox.path('python/3.13.3')
+    prev_fileint_tbl, prev_file_tbl = fi.read_saved_tbls(sandbox.filters(PACKAGE))
+    assert normalized(fi.stream_compare(base_path, [])) == normalized(fi.tbl_compare(prev_file_tbl, {}))
+    assert normalized(fi.stream_compare(sandbox.path('r/4.4.1'), [])) == []
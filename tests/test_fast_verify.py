@@ -0,0 +1,23 @@
+# fast verify - files with an unchanged stat tuple are not hashed again
+
+PACKAGE = 'python:3.13.3'
+
+def test_fast_verify(sandbox):
+    sandbox.configure(fast_verify=True)
+    assert sandbox.passed(sandbox.test(PACKAGE))
+
+    fi = sandbox.fileint()
+    assert sandbox.passed(sandbox.test(PACKAGE, fi=fi))
+    assert fi.stats['skipped'] == 3
+    assert fi.stats['rehashed'] == 0
+
+    sandbox.write('python/3.13.3/lib/sub/a.txt', b'y\n')
+    fi = sandbox.fileint()
+    assert ('lib/sub/a.txt', 'content_hash') in sandbox.file_diffs(sandbox.test(PACKAGE, fi=fi))
+    assert fi.stats['rehashed'] == 1
+
+    # --full-verify hashes every file
+    fi = sandbox.fileint()
+    sandbox.test(PACKAGE, full_verify=True, fi=fi)
+    assert fi.stats['skipped'] == 0
+    assert fi.stats['rehashed'] == 3
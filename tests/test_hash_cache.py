@@ -0,0 +1,70 @@
+# hash_cache - content hashes by inode, shared across packages and runs
+
+import os
+import types
+import sqlite3
+
+from pkgtst.lib import hash_cache
+from pkgtst.lib.hash_cache import HashCache
+
+def fake_stat(ino, mtime=1000000000):
+    return types.SimpleNamespace(st_dev=1, st_ino=ino, st_size=10, st_mtime_ns=mtime * 10**9, st_ctime_ns=mtime * 10**9)
+
+def test_get_put(sandbox):
+    cache_file = os.path.join(sandbox.root, 'hash_cache.sql')
+    cache = HashCache(cache_file, config_path=sandbox.config_path)
+    assert cache.get(fake_stat(1), 'sha256') is None
+    cache.put(fake_stat(1), 'sha256', 'aa')
+    cache.close()
+
+    cache = HashCache(cache_file, config_path=sandbox.config_path)
+    assert cache.get(fake_stat(1), 'sha256') == 'aa'
+    assert cache.get(fake_stat(1), 'blake2b') is None
+    assert cache.get(fake_stat(1, mtime=1000000001), 'sha256') is None
+    assert cache.stats == {'hits': 1, 'misses': 2}
+    cache.close()
+
+# a file modified within RACY_SECONDS may still change without a new
+# timestamp, its hash is not kept
+def test_racy_file_not_cached(sandbox):
+    cache = HashCache(os.path.join(sandbox.root, 'hash_cache.sql'), config_path=sandbox.config_path)
+    st = os.stat(sandbox.path('tool/1.0/t'))
+    cache.put(st, 'sha256', 'aa')
+    assert cache.get(st, 'sha256') is None
+    cache.close()
+
+def test_evict_max_entries(sandbox):
+    cache_file = os.path.join(sandbox.root, 'hash_cache.sql')
+    cache = HashCache(cache_file, max_entries=3, config_path=sandbox.config_path)
+    for ino in range(5):
+        cache.put(fake_stat(ino), 'sha256', str(ino))
+    cache.evict()
+    cache.close()
+
+    conn = sqlite3.connect(cache_file)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0] == 3
+        assert conn.execute("SELECT entries FROM hash_cache_count").fetchone()[0] == 3
+        kept = conn.execute("SELECT ino FROM hash_cache").fetchone()[0]
+    finally:
+        conn.close()
+
+    # replacing an entry doesn't change the count
+    cache = HashCache(cache_file, max_entries=3, config_path=sandbox.config_path)
+    cache.put(fake_stat(kept), 'sha256', 'changed')
+    cache.evict()
+    assert cache.get(fake_stat(kept), 'sha256') == 'changed'
+    assert cache.connect().execute("SELECT entries FROM hash_cache_count").fetchone()[0] == 3
+    cache.close()
+
+def test_scan_with_hash_cache(sandbox, monkeypatch):
+    monkeypatch.setattr(hash_cache, 'RACY_SECONDS', 0)
+    sandbox.configure(hash_cache=True)
+    assert sandbox.passed(sandbox.test('python:3.13.3'))
+
+    fi = sandbox.fileint()
+    assert sandbox.passed(sandbox.test('python:3.13.3', fi=fi))
+    assert fi.hash_cache.stats['hits'] == 3
+
+    sandbox.write('python/3.13.3/lib/sub/a.txt', b'changed\n')
+    assert ('lib/sub/a.txt', 'content_hash') in sandbox.file_diffs(sandbox.test('python:3.13.3'))
@@ -0,0 +1,44 @@
+# hasher - digests of the pool workers, and files vanishing during a scan
+
+import os
+import hashlib
+
+from pkgtst.lib.hasher import Hasher
+from pkgtst.lib.hasher import init_worker
+from pkgtst.lib.hasher import hash_file
+from pkgtst.lib.hasher import sampled_tier
+from pkgtst.lib.fileint import MismatchType
+
+def test_file_digest(sandbox):
+    hasher = Hasher(block_size=4096, mmap_threshold=None, config_path=sandbox.config_path)
+    path = sandbox.path('python/3.13.3/lib/big.bin')
+    with open(path, 'rb') as f:
+        content = f.read()
+    assert hasher.file_digest(path) == hashlib.sha256(content).hexdigest()
+    assert hasher.file_digest(path, 'blake2b-32') == hashlib.blake2b(content, digest_size=32).hexdigest()
+
+    # the mmap path gives the same digest
+    hasher = Hasher(mmap_threshold=1, config_path=sandbox.config_path)
+    assert hasher.file_digest(path) == hashlib.sha256(content).hexdigest()
+
+def test_vanished_file(sandbox):
+    init_worker(Hasher(config_path=sandbox.config_path))
+    path = sandbox.path('python/3.13.3/missing')
+    assert hash_file((0, path, 'sha256', 'full', None)) == (0, None, None)
+    assert hash_file((1, path, 'sha256', sampled_tier(4, 16, 2), 0)) == (1, None, None)
+
+# a file removed between the walk and its hashing is reported as missing
+def test_file_vanishing_during_scan(sandbox):
+    sandbox.test('python:3.13.3')
+
+    fi = sandbox.fileint()
+    walk_package = fi.walk_package
+    def walk_and_remove(root, *args):
+        for path, st in walk_package(root, *args):
+            yield path, st
+            if path.endswith('/a.txt'):
+                os.remove(path)
+    fi.walk_package = walk_and_remove
+
+    results = sandbox.test('python:3.13.3', fi=fi)
+    assert [(diff['row'][1], diff['mismatch_type']) for diff in results[3] if diff['column'] is None] == [('lib/sub/a.txt', MismatchType.MISSING_ROW)]
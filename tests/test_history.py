@@ -0,0 +1,74 @@
+# baseline history - delta writes, generations and rollback
+
+import os
+import sys
+import yaml
+
+from pkgtst.tools import pkgtst
+
+PACKAGE = 'python:3.13.3'
+
+def saved_rows(sandbox, package_id=PACKAGE):
+    fileint_tbl, file_tbl = sandbox.fileint().read_saved_tbls(sandbox.filters(package_id))
+    return dict(fileint_tbl), dict([(key, dict(row)) for key, row in file_tbl.items()])
+
+def change_package(sandbox):
+    sandbox.write('python/3.13.3/lib/sub/a.txt', b'changed\n')
+    sandbox.write('python/3.13.3/new', b'new\n')
+    os.remove(sandbox.path('python/3.13.3/bin/python'))
+
+def test_delta_write(sandbox):
+    sandbox.test(PACKAGE)
+    change_package(sandbox)
+    sandbox.test(PACKAGE, accept=True)
+
+    fileint_tbl, file_tbl = saved_rows(sandbox)
+    base_path = sandbox.path('python/3.13.3')
+    assert (base_path, 'bin/python') not in file_tbl
+    assert (base_path, 'new') in file_tbl
+    assert file_tbl[(base_path, 'lib/sub/a.txt')]['file_size'] == len(b'changed\n')
+    # the rows of the other packages are untouched
+    assert sandbox.passed(sandbox.test('r:4.4.1'))
+    assert sandbox.passed(sandbox.test(PACKAGE))
+
+def test_rollback_round_trip(sandbox):
+    sandbox.test(PACKAGE)
+    first = saved_rows(sandbox)
+    change_package(sandbox)
+    sandbox.test(PACKAGE, accept=True)
+    second = saved_rows(sandbox)
+    assert second != first
+
+    fi = sandbox.fileint()
+    filters = sandbox.filters(PACKAGE)
+    base_path = sandbox.path('python/3.13.3')
+    assert [generation[0] for generation in fi.history(filters)[base_path]] == [1, 2]
+
+    diffs = fi.diff_generations(filters, 1)[base_path]
+    assert sorted([(diff['row'][1], diff['mismatch_type'].name) for diff in diffs if diff['column'] is None]) == [('bin/python', 'MISSING_ROW'), ('new', 'EXTRA_ROW')]
+
+    fi.rollback(filters)
+    assert saved_rows(sandbox) == first
+    assert [generation[0] for generation in fi.history(filters)[base_path]] == [1, 2, 3]
+
+    # the rollback is a generation of its own
+    fi.rollback(filters)
+    assert saved_rows(sandbox) == second
+
+# the history commands parse the package id with the hierarchy of the config
+# given with -c
+def test_history_commands_use_config_path(sandbox, monkeypatch, capsys):
+    sandbox.test(PACKAGE)
+    change_package(sandbox)
+    sandbox.test(PACKAGE, accept=True)
+
+    config_path = os.path.join(sandbox.root, 'etc', 'other.yaml')
+    os.rename(sandbox.config_path, config_path)
+    default_config = dict(sandbox.config, general=dict(sandbox.config['general'], hierarchy='{package_name}'))
+    with open(sandbox.config_path, 'w') as f:
+        yaml.safe_dump(default_config, f)
+
+    for command in (['history', PACKAGE], ['diff', PACKAGE, '1'], ['rollback', PACKAGE]):
+        monkeypatch.setattr(sys, 'argv', ['pkgtst', '-c', config_path] + command)
+        assert pkgtst.main() == 0
+    assert 'MISSING_ROW bin/python' in capsys.readouterr().out
@@ -0,0 +1,46 @@
+# local_runner - concurrent package tests on the current host
+
+import time
+
+from pkgtst.lib.local_runner import LocalRunner
+
+PACKAGES = ['python:3.13.3', 'r:4.4.1', 'tool:1.0']
+
+def test_exec_all(sandbox, capsys):
+    def test_func(package_id, fi):
+        results = sandbox.test(package_id, fi=fi)
+        print("FILEINT -- [PASSED]" if sandbox.passed(results) else "FILEINT -- [FAILED]")
+        return {'passed_fileint': sandbox.passed(results), 'passed_lnfs': True}
+
+    runner = LocalRunner(config_path=sandbox.config_path, jobs=2)
+    results = runner.exec_all(list(PACKAGES), test_func)
+    assert len(results) == 3
+    assert all([result['passed_fileint'] for result in results])
+    assert sorted(capsys.readouterr().out.splitlines()) == [f"{package_id}: FILEINT -- [PASSED]" for package_id in PACKAGES]
+
+# with several jobs, the lines a test prints are kept together and prefixed
+# with its package id even while the other tests print
+def test_exec_all_output_blocks(sandbox, capsys):
+    def test_func(package_id, fi):
+        for i in range(3):
+            print(f"line {i}")
+            time.sleep(0.01)
+        return {'passed_fileint': True, 'passed_lnfs': True}
+
+    LocalRunner(config_path=sandbox.config_path, jobs=3).exec_all(list(PACKAGES), test_func)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 9
+    package_ids = []
+    for block in range(3):
+        package_id = lines[3 * block].rsplit(': ', 1)[0]
+        assert lines[3 * block:3 * block + 3] == [f"{package_id}: line {i}" for i in range(3)]
+        package_ids.append(package_id)
+    assert sorted(package_ids) == PACKAGES
+
+def test_exec_all_single_job(sandbox, capsys):
+    def test_func(package_id, fi):
+        print("FILEINT -- [PASSED]")
+        return {'passed_fileint': True, 'passed_lnfs': True}
+
+    LocalRunner(config_path=sandbox.config_path, jobs=1).exec_all(list(PACKAGES), test_func)
+    assert capsys.readouterr().out == "FILEINT -- [PASSED]\n" * 3
@@ -0,0 +1,59 @@
+# packed baselines - conversion from and to sqlite3, and batched writes
+
+import os
+
+from pkgtst.lib import fileint
+from pkgtst.lib.local_runner import LocalRunner
+
+PACKAGES = ['python:3', 'python:3.13.3', 'r:4.4.1', 'tool:1.0']
+
+# {base_path: fileint row}, {(base_path, relative_path): file row} of a
+# baseline, as plain dicts
+def saved_rows(fi):
+    fileint_tbl, file_tbl = fi.read_saved_tbls()
+    return dict(fileint_tbl), dict([(key, dict(row)) for key, row in file_tbl.items()])
+
+def test_sqlite_packed_round_trip(sandbox):
+    sandbox.configure(sample_threshold=100000)
+    for package_id in PACKAGES:
+        sandbox.test(package_id)
+    sqlite_file = sandbox.config['fileint']['dbfile']
+    packed_file = os.path.join(sandbox.root, 'var', 'db', 'fileint.pack')
+    converted_file = os.path.join(sandbox.root, 'var', 'db', 'converted.sql')
+
+    fi = sandbox.fileint()
+    fi.sqlite_to_packed([sqlite_file], packed_file)
+    fi.packed_to_sqlite(packed_file, converted_file)
+
+    expected = saved_rows(sandbox.fileint())
+    assert len(expected[0]) == len(PACKAGES)
+    sandbox.configure(dbfile=converted_file)
+    assert saved_rows(sandbox.fileint()) == expected
+    sandbox.configure(format='packed', dbfile=packed_file)
+    assert saved_rows(sandbox.fileint()) == expected
+
+    for package_id in PACKAGES:
+        assert sandbox.passed(sandbox.test(package_id))
+
+# the packages tested by LocalRunner are written to the packed baseline at once
+def test_exec_all_writes_packed_once(sandbox, monkeypatch):
+    sandbox.configure(format='packed', dbfile=os.path.join(sandbox.root, 'var', 'db', 'fileint.pack'))
+    writes = []
+    write_packed = fileint.write_packed
+    def count_writes(path, hierarchy, packages, rows):
+        writes.append(len(packages))
+        write_packed(path, hierarchy, packages, rows)
+    monkeypatch.setattr(fileint, 'write_packed', count_writes)
+
+    def test_func(package_id, fi):
+        results = sandbox.test(package_id, fi=fi)
+        return {'passed_fileint': sandbox.passed(results), 'passed_lnfs': True}
+
+    runner = LocalRunner(config_path=sandbox.config_path, jobs=2)
+    assert all([result['passed_fileint'] for result in runner.exec_all(list(PACKAGES), test_func)])
+    assert writes == [4]
+    assert all([result['passed_fileint'] for result in runner.exec_all(list(PACKAGES), test_func)])
+    assert writes == [4]
+
+    sandbox.write('tool/1.0/t', b'changed\n')
+    assert not sandbox.passed(sandbox.test('tool:1.0'))
@@ -0,0 +1,59 @@
+# sharded baselines - migrating an unsharded baseline into per-package shards
+
+import os
+import sqlite3
+
+PACKAGE = 'python:3.13.3'
+
+def count_rows(dbfile, table, base_path):
+    conn = sqlite3.connect(dbfile)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE base_path = ?", (base_path,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_migrate_to_shard(sandbox):
+    sandbox.test(PACKAGE)
+    sandbox.write('python/3.13.3/lib/sub/a.txt', b'changed\n')
+    sandbox.test(PACKAGE, accept=True)
+    sandbox.test('r:4.4.1')
+
+    dbfile = sandbox.config['fileint']['dbfile']
+    base_path = sandbox.path('python/3.13.3')
+    shard_dir = os.path.join(sandbox.root, 'var', 'db', 'shards')
+    sandbox.configure(shard_dir=shard_dir)
+
+    assert sandbox.passed(sandbox.test(PACKAGE))
+    shard_file = os.path.join(shard_dir, 'python', '3.13.3.sql')
+    assert os.path.exists(shard_file)
+
+    # moved, not copied, the other packages stay where they are until tested
+    for table in ('fileint', 'file', 'dir_digest', 'baseline_generation', 'baseline_delta'):
+        assert count_rows(dbfile, table, base_path) == 0
+    assert count_rows(shard_file, 'file', base_path) > 0
+    assert count_rows(dbfile, 'fileint', sandbox.path('r/4.4.1')) == 1
+
+    # the history came along
+    fi = sandbox.fileint()
+    filters = sandbox.filters(PACKAGE)
+    assert [generation[0] for generation in fi.history(filters)[base_path]] == [1, 2]
+
+    sandbox.write('python/3.13.3/lib/sub/a.txt', b'changed again\n')
+    assert ('lib/sub/a.txt', 'content_hash') in sandbox.file_diffs(sandbox.test(PACKAGE))
+    assert sandbox.passed(sandbox.test('r:4.4.1'))
+    assert os.path.exists(os.path.join(shard_dir, 'r', '4.4.1.sql'))
+
+    fi.rollback(filters)
+    with fi.use_shard(shard_file):
+        rows = fi.read_saved_tbls(filters)[1]
+    assert rows[(base_path, 'lib/sub/a.txt')]['file_size'] == len(b'x\n')
+
+# a package tested for the first time with shard_dir gets its shard right away
+def test_new_package_in_shard(sandbox):
+    shard_dir = os.path.join(sandbox.root, 'var', 'db', 'shards')
+    sandbox.configure(shard_dir=shard_dir)
+    assert sandbox.passed(sandbox.test('tool:1.0'))
+    assert sandbox.passed(sandbox.test('tool:1.0'))
+    assert os.listdir(shard_dir) == ['tool']
+    sandbox.write('tool/1.0/t', b'changed\n')
+    assert not sandbox.passed(sandbox.test('tool:1.0'))
@@ -0,0 +1,65 @@
+# hash tiers and algorithms changing between a baseline and its verification:
+# each file is verified with the tier and algorithm of its baseline row until
+# the package is accepted again
+
+import os
+
+PACKAGE = 'python:3.13.3'
+
+def test_enable_sampling_on_existing_baseline(sandbox):
+    assert sandbox.passed(sandbox.test(PACKAGE))
+    sandbox.configure(sample_threshold=100000)
+    assert sandbox.passed(sandbox.test(PACKAGE))
+
+def test_change_algorithm_on_existing_baseline(sandbox):
+    assert sandbox.passed(sandbox.test(PACKAGE))
+    sandbox.configure(hash_algorithm='blake2b', hash_digest_size=32)
+    assert sandbox.passed(sandbox.test(PACKAGE))
+
+def test_enable_sampling_and_change_algorithm(sandbox):
+    assert sandbox.passed(sandbox.test(PACKAGE))
+    sandbox.configure(sample_threshold=100000, hash_algorithm='blake2b')
+    assert sandbox.passed(sandbox.test(PACKAGE))
+    sandbox.write('python/3.13.3/lib/big.bin', b'changed' * 50000)
+    assert ('lib/big.bin', 'content_hash') in sandbox.file_diffs(sandbox.test(PACKAGE))
+
+# (relative_path, hash_algorithm, hash_tier) of the regular files in the
+# baseline of the package
+def hashed_with(sandbox, package_id=PACKAGE):
+    fi = sandbox.fileint()
+    fileint_tbl, file_tbl = fi.read_saved_tbls(sandbox.filters(package_id))
+    return sorted([(key[1], row['hash_algorithm'], row['hash_tier']) for key, row in file_tbl.items() if row['hash_algorithm'] is not None])
+
+def test_tier_and_algorithm_kept_until_accept(sandbox):
+    sandbox.test(PACKAGE)
+    sandbox.configure(sample_threshold=100000, hash_algorithm='blake2b')
+    fi = sandbox.fileint()
+    sandbox.test(PACKAGE)
+    assert hashed_with(sandbox) == [('bin/python', 'sha256', 'full'), ('lib/big.bin', 'sha256', 'full'), ('lib/sub/a.txt', 'sha256', 'full')]
+
+    assert sandbox.test(PACKAGE, accept=True)[3] is None
+    assert hashed_with(sandbox) == [('bin/python', 'blake2b', 'full'), ('lib/big.bin', 'blake2b', fi.sample_tier), ('lib/sub/a.txt', 'blake2b', 'full')]
+    assert sandbox.passed(sandbox.test(PACKAGE))
+
+def test_disable_sampling_on_sampled_baseline(sandbox):
+    sandbox.configure(sample_threshold=100000)
+    sandbox.test(PACKAGE)
+    sandbox.configure(sample_threshold=None)
+    assert sandbox.passed(sandbox.test(PACKAGE))
+    assert sandbox.passed(sandbox.test(PACKAGE, full_verify=True))
+
+# a change that the sampled stripes miss is found once the rotation gets to
+# the segment holding it
+def test_segment_rotation_finds_change(sandbox):
+    sandbox.configure(sample_threshold=100000, sample_stripes=1, sample_stripe_size=16, sample_segments=4)
+    sandbox.test(PACKAGE)
+    path = sandbox.path('python/3.13.3/lib/big.bin')
+    st = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.seek(st.st_size // 4 + 1000)
+        f.write(b'\xff\xfe')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    diffs = [sandbox.file_diffs(sandbox.test(PACKAGE)) for run in range(4)]
+    assert diffs.count([('lib/big.bin', 'segment_hashes')]) == 1
+    assert diffs.count([]) == 3